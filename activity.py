@@ -0,0 +1,63 @@
+from collections import OrderedDict, deque
+
+
+class ChatActivity:
+    """Recent message timestamps and the #срач cooldown of one chat.
+
+    Only the last min_messages timestamps are kept: that is all we need to
+    tell whether the chat reached min_messages within the window, so each
+    chat costs a fixed amount of memory however busy it is.
+    """
+
+    __slots__ = ("timestamps", "last_dispute_time")
+
+    def __init__(self, min_messages):
+        self.timestamps = deque(maxlen=min_messages)
+        self.last_dispute_time = 0
+
+
+class ActivityTracker:
+    """Per-chat sliding windows with O(1) amortized work per message.
+
+    At most max_chats chats are tracked; the one that was quiet the longest
+    is forgotten first.
+    """
+
+    def __init__(self, window, min_messages, dispute_timeout, max_chats=1000):
+        self.window = window
+        self.min_messages = min_messages
+        self.dispute_timeout = dispute_timeout
+        self.max_chats = max_chats
+        self._chats = OrderedDict()
+
+    def __len__(self):
+        return len(self._chats)
+
+    def items(self):
+        """(chat_id, ChatActivity) pairs, least recently active first"""
+        return self._chats.items()
+
+    def get(self, chat_id):
+        activity = self._chats.get(chat_id)
+        if activity is None:
+            activity = self._chats[chat_id] = ChatActivity(self.min_messages)
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return activity
+
+    def record(self, chat_id, now):
+        """Adds a message at time now and drops the ones that left the window"""
+        activity = self.get(chat_id)
+        timestamps = activity.timestamps
+        timestamps.append(now)
+        while now - timestamps[0] > self.window:
+            timestamps.popleft()
+        return activity
+
+    def is_busy(self, activity):
+        return len(activity.timestamps) >= self.min_messages
+
+    def cooling_down(self, activity, now):
+        return now - activity.last_dispute_time <= self.dispute_timeout
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+from collections import namedtuple
+
+from media import content_hash
+
+try:
+    from PIL import Image  # Optional, only used to record image dimensions
+except ImportError:
+    Image = None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(BASE_DIR, "assets_manifest.json")
+ASSET_FOLDERS = ("mistchypark", "zeldafaces")
+
+# url: public raw.githubusercontent.com link, path: local copy or None, sha: git blob hash
+Asset = namedtuple("Asset", ["name", "url", "path", "sha"])
+
+
+def image_dimensions(path):
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(path) as img:
+            return img.width, img.height
+    except OSError:
+        return None, None
+
+
+def scan_folder(folder_path):
+    """Lists the images in a folder with their size, hash and dimensions"""
+    entries = []
+    for name in sorted(os.listdir(folder_path)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(folder_path, name)
+        width, height = image_dimensions(path)
+        entries.append({
+            "name": name,
+            "size": os.path.getsize(path),
+            "sha": content_hash(path),
+            "width": width,
+            "height": height,
+        })
+    return entries
+
+
+def build_manifest(base_dir=BASE_DIR, folders=ASSET_FOLDERS):
+    return {folder: scan_folder(os.path.join(base_dir, folder)) for folder in folders}
+
+
+def write_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def load_folder_entries(folder, base_dir=BASE_DIR, manifest_path=MANIFEST_PATH):
+    """Entries for one folder from the prebuilt manifest, rescanning if it is missing or out of date.
+
+    A file counts as unchanged if its name and size match the manifest. The
+    manifest's sha is the media cache key and tells whether the local copy is
+    what GitHub has, so an image replaced under the same name must not keep it.
+    """
+    folder_path = os.path.join(base_dir, folder)
+    try:
+        local_sizes = {
+            name: os.path.getsize(os.path.join(folder_path, name))
+            for name in os.listdir(folder_path) if name.lower().endswith(IMAGE_EXTENSIONS)
+        }
+    except FileNotFoundError:
+        local_sizes = {}
+
+    entries = None
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            entries = json.load(f).get(folder)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.error(f"❌ Failed to read asset manifest: {e}")
+
+    if entries is not None and {entry["name"]: entry["size"] for entry in entries} == local_sizes:
+        return entries
+    if local_sizes:
+        logging.info(f"🔄 Asset manifest is missing or stale for {folder}/, scanning it")
+        return scan_folder(folder_path)
+    return entries or []
+
+
+class AssetLibrary:
+    """The images of one repo folder, served from the local manifest.
+
+    refresh() asks the GitHub contents API for the folder with a conditional
+    ETag request and, if anything changed, swaps in a new tuple of assets in
+    one assignment, so handlers always see either the old or the new list.
+    """
+
+    def __init__(self, folder, base_url, api_url, base_dir=BASE_DIR):
+        self.folder = folder
+        self.base_url = base_url
+        self.api_url = api_url
+        self.local_dir = os.path.join(base_dir, folder)
+        self.assets = ()
+        self._local_shas = {}  # name -> sha of the local copy
+        self._etag = None
+
+    def __len__(self):
+        return len(self.assets)
+
+    def load(self, entries):
+        self._local_shas = {entry["name"]: entry["sha"] for entry in entries}
+        self.assets = tuple(self._asset(entry["name"], entry["sha"]) for entry in entries)
+
+    def _asset(self, name, sha):
+        # Only upload the local file if it is the same content GitHub has
+        local = os.path.join(self.local_dir, name) if self._local_shas.get(name) == sha else None
+        return Asset(name, self.base_url + name, local, sha)
+
+    async def refresh(self, client, token=None):
+        """Re-lists the folder on GitHub; returns True if the asset list was replaced"""
+        headers = {"Accept": "application/vnd.github+json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+
+        response = await client.get(self.api_url, headers=headers)
+        if response.status_code == 304:
+            return False
+        response.raise_for_status()
+
+        assets = tuple(
+            self._asset(item["name"], item["sha"])
+            for item in sorted(response.json(), key=lambda item: item["name"])
+            if item["type"] == "file" and item["name"].lower().endswith(IMAGE_EXTENSIONS)
+        )
+        self._etag = response.headers.get("ETag")
+        if assets == self.assets:
+            return False
+        self.assets = assets
+        logging.info(f"🔄 {self.folder}/ refreshed from GitHub: {len(assets)} images")
+        return True
+
+
+if __name__ == "__main__":
+    # Regenerate assets_manifest.json after adding or replacing images
+    manifest = build_manifest()
+    write_manifest(manifest)
+    for folder, entries in manifest.items():
+        print(f"✅ {folder}: {len(entries)} images, {sum(e['size'] for e in entries)} bytes")
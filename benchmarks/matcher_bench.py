@@ -0,0 +1,87 @@
+"""Micro-benchmark: TriggerMatcher.scan() against the old per-message substring checks.
+
+    python benchmarks/matcher_bench.py [--passes 20]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import DISPUTE_PHRASES, TRIGGERS  # noqa: E402
+from matcher import DISPUTE, ZELDA, TAG_ALL, MANUAL_DISPUTE  # noqa: E402
+
+OLD_KEYWORDS = [
+    "зельда", "зельдос", "Зельда", "Зельдос",
+    "зельду", "зельдоса", "Зельду", "Зельдоса",
+    "зельдою", "зельдосом", "Зельдою", "Зельдосом"
+]
+
+# Typical group chat traffic: mostly short messages without any trigger
+MESSAGES = [
+    "привіт всім",
+    "хто сьогодні йде на каву?",
+    "я буду після шостої",
+    "ок",
+    "😂😂😂",
+    "а де зустрічаємось?",
+    "біля фонтану, як завжди",
+    "ну такоє, я б краще в парк пішла",
+    "ти не розумієш, там зараз ремонт",
+    "Зельда, ти як?",
+    "зельдос знову спить на клавіатурі",
+    "@all збираємось о сьомій",
+    "маячня якась, я не згоден",
+    "#срач",
+    "скиньте фотки з вчорашнього",
+    "дякую!",
+    "а хто взяв мій зонтик?",
+    "вибач, не бачила повідомлення",
+    "слухайте, а може замовимо піцу? я вже голодна як вовк, а до вечері ще дуже далеко",
+    "я не люблю ананаси на піці, це не так має бути",
+    ">> а ти подумай ще раз",
+    "купила нового чаю в джоконді, рекомендую лавандову ніч",
+    "хтось бачив Зельдою забутий шарф?",
+    "сьогодні дуже холодно, одягайтесь тепліше",
+    "так вважаю",
+]
+
+
+def old_scan(text):
+    found = set()
+    if any(phrase in text.lower() for phrase in DISPUTE_PHRASES):
+        found.add(DISPUTE)
+    if "#срач" in text.lower():
+        found.add(MANUAL_DISPUTE)
+    if "@all" in text.lower():
+        found.add(TAG_ALL)
+    if any(word in text for word in OLD_KEYWORDS):
+        found.add(ZELDA)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--passes", type=int, default=20, help="passes over the 1000-message stream per run")
+    args = parser.parse_args()
+
+    random.seed(0)
+    stream = [random.choice(MESSAGES) for _ in range(1000)]
+
+    mismatches = [m for m in MESSAGES if old_scan(m) != TRIGGERS.scan(m)]
+    for message in mismatches:
+        print(f"≠ {message!r}: old={sorted(old_scan(message))} new={sorted(TRIGGERS.scan(message))}")
+
+    results = {}
+    for name, scan in (("old", old_scan), ("matcher", TRIGGERS.scan)):
+        seconds = min(timeit.repeat(lambda: [scan(m) for m in stream], number=args.passes, repeat=5))
+        per_message = seconds / (args.passes * len(stream))
+        results[name] = per_message
+        print(f"{name:8} {per_message * 1e6:7.2f} µs/message")
+    print(f"speedup  {results['old'] / results['matcher']:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""Replays Telegram updates through the real handler stack and reports throughput and latency.
+
+    python benchmarks/replay.py                       # 5000 synthetic updates
+    python benchmarks/replay.py --input updates.jsonl # recorded updates, one JSON object per line
+    python benchmarks/replay.py --api-latency 50 --storage memory --db-latency 5
+
+Handlers are registered by main.build_application(); only the network edges
+are replaced: Bot API calls go to an in-process sink and the users table to
+a throwaway SQLite database (or, with --storage memory, a dict with
+simulated latency). Every run appends one JSON line (with the git
+commit) to bench_output.txt and prints the change against the previous run
+with the same parameters.
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_GROUP_ID = -1001000000001
+BENCH_ADMIN_ID = 424242
+
+# main.py reads its configuration at import
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("TARGET_GROUP_ID", str(BENCH_GROUP_ID))
+os.environ.setdefault("BOT_ADMINS", str(BENCH_ADMIN_ID))
+SCRATCH = tempfile.TemporaryDirectory(prefix="zelebot-replay-")
+atexit.register(SCRATCH.cleanup)
+SCRATCH_DIR = SCRATCH.name
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(SCRATCH_DIR, "users.db")
+os.environ["MEDIA_CACHE_PATH"] = os.path.join(SCRATCH_DIR, "media_cache.json")
+os.environ["STATE_PATH"] = os.path.join(SCRATCH_DIR, "chat_state")
+os.environ.pop("WEBHOOK_URL", None)
+
+import main  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+from outbound import PriorityRateLimiter  # noqa: E402
+from db import SqliteStorage  # noqa: E402
+from teas import CATEGORY_EMOJI, RANDOM_CATEGORY  # noqa: E402
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "zelebot", "username": "zelebot"}
+
+TEXTS = [
+    "привіт всім", "хто сьогодні йде на каву?", "ок", "😂😂😂", "біля фонтану, як завжди",
+    "а де зустрічаємось?", "скиньте фотки з вчорашнього", "дякую!", "сьогодні дуже холодно",
+    "слухайте, а може замовимо піцу? я вже голодна як вовк, а до вечері ще дуже далеко",
+]
+TRIGGER_TEXTS = [
+    "Зельда, ти де?", "зельдос знову спить", "ну такоє, ти не розумієш", "маячня, я не згоден",
+    "@all збираємось о сьомій", "#срач",
+]
+COMMANDS = ["/spies", "/tea", "/bridge_or_park", "/start", "/stats"]
+TEA_QUERIES = ["", "лав", "зелений", "равлик", "пуер", "лавандва ніч", "чай"]
+
+
+class FakeBotAPI(BaseRequest):
+    """Answers every Bot API call locally with a plausible result"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 10_000
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params, **extra):
+        self._message_id += 1
+        chat_id = int(params.get("chat_id", BENCH_GROUP_ID))
+        message = {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            return []
+        if endpoint == "sendMessage":
+            return self._message(params, text=str(params.get("text", "")))
+        if endpoint == "sendPhoto":
+            file_id = f"photo-{self._message_id}"
+            return self._message(params, photo=[
+                {"file_id": file_id, "file_unique_id": file_id, "width": 600, "height": 850},
+            ])
+        if endpoint == "sendSticker":
+            file_id = f"sticker-{self._message_id}"
+            return self._message(params, sticker={
+                "file_id": file_id, "file_unique_id": file_id, "type": "regular",
+                "width": 512, "height": 512, "is_animated": False, "is_video": False,
+            })
+        if endpoint == "editMessageText":
+            return self._message(params, text=str(params.get("text", "")))
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency and endpoint != "getUpdates":
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+
+class MemoryStorage:
+    """Storage backend that keeps the users table in a dict, with simulated latency"""
+
+    name = "Memory"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.users = {}
+        self.members = set()
+        self.activity = {}
+
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def setup(self):
+        await self._round_trip()
+
+    async def upsert_users(self, rows):
+        await self._round_trip()
+        for user_id, username, first_name in rows:
+            self.users[user_id] = (username, first_name)
+
+    async def fetch_users(self):
+        await self._round_trip()
+        return [(user_id, *identity) for user_id, identity in self.users.items()]
+
+    async def add_chat_members(self, rows):
+        await self._round_trip()
+        self.members.update(rows)
+
+    async def remove_chat_members(self, rows):
+        await self._round_trip()
+        self.members.difference_update(rows)
+
+    async def fetch_chat_members(self):
+        await self._round_trip()
+        return list(self.members)
+
+    async def add_user_activity(self, rows):
+        await self._round_trip()
+        for chat_id, user_id, messages in rows:
+            self.activity[(chat_id, user_id)] = self.activity.get((chat_id, user_id), 0) + messages
+
+    async def fetch_user_activity(self):
+        await self._round_trip()
+        return [(*key, messages) for key, messages in self.activity.items()]
+
+
+class CountingStorage:
+    """Counts the database round-trips made through a storage backend"""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self.round_trips = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if name in ("open", "close") or not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        async def counted(*args, **kwargs):
+            self.round_trips += 1
+            return await attribute(*args, **kwargs)
+        return counted
+
+
+def synthetic_updates(count, chats, users, seed):
+    rng = random.Random(seed)
+    chat_ids = [BENCH_GROUP_ID] + [BENCH_GROUP_ID - n for n in range(1, chats)]
+    people = [
+        {"id": 1000 + n, "is_bot": False, "first_name": f"Користувач {n}",
+         **({"username": f"user{n}"} if n % 3 else {})}
+        for n in range(users)
+    ]
+    updates = []
+    for update_id in range(1, count + 1):
+        chat = {"id": rng.choice(chat_ids), "type": "supergroup", "title": "bench"}
+        sender = rng.choice(people)
+        roll = rng.random()
+        message = {"message_id": update_id, "date": 1760000000 + update_id, "chat": chat, "from": sender}
+        if roll < 0.03:
+            message["text"] = "🍵"
+            updates.append({"update_id": update_id, "callback_query": {
+                "id": str(update_id), "from": sender, "chat_instance": "bench",
+                "data": f"tea_{rng.choice([RANDOM_CATEGORY, *CATEGORY_EMOJI])}", "message": message,
+            }})
+            continue
+        if roll < 0.04:
+            updates.append({"update_id": update_id, "inline_query": {
+                "id": str(update_id), "from": sender, "query": rng.choice(TEA_QUERIES), "offset": "",
+            }})
+            continue
+        if roll < 0.08:
+            command = rng.choice(COMMANDS)
+            message["text"] = command
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        elif roll < 0.20:
+            message["text"] = rng.choice(TRIGGER_TEXTS)
+        else:
+            message["text"] = rng.choice(TEXTS)
+        updates.append({"update_id": update_id, "message": message})
+    return updates
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def replay(raw_updates, api_latency, storage_kind, db_latency):
+    api = FakeBotAPI(latency=api_latency)
+    if storage_kind == "memory":
+        storage = CountingStorage(MemoryStorage(latency=db_latency))
+    else:
+        storage = CountingStorage(SqliteStorage(os.path.join(tempfile.mkdtemp(dir=SCRATCH_DIR), "users.db")))
+    # The real limiter would (correctly) hold the replay to 20 messages a minute per group
+    main.rate_limiter = PriorityRateLimiter(overall_per_second=1e9, private_per_second=1e9, group_per_minute=1e9)
+    main.storage = main.user_writer.storage = main.activity_counters.storage = storage
+
+    app = main.build_application(request=api)
+    handler_times = defaultdict(list)
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            callback = handler.callback
+
+            async def timed(update, context, callback=callback):
+                started = time.perf_counter()
+                try:
+                    return await callback(update, context)
+                finally:
+                    handler_times[callback.__name__].append(time.perf_counter() - started)
+
+            handler.callback = timed
+
+    update_times = []
+    processor = main.update_processor
+    original = processor.do_process_update
+
+    async def timed_update(update, coroutine):
+        async def timed():
+            started = time.perf_counter()  # Once the update got its chat and a slot
+            try:
+                await coroutine
+            finally:
+                update_times.append(time.perf_counter() - started)
+
+        await original(update, timed())
+
+    processor.do_process_update = timed_update
+
+    await app.initialize()  # Also sets up the database in the background
+    await main.database_ready.wait()
+    await app.start()
+    updates = [Update.de_json(data, app.bot) for data in raw_updates]
+    api.calls.clear()
+    storage.round_trips = 0
+
+    started = time.perf_counter()
+    for update in updates:
+        await app.update_queue.put(update)
+    await app.update_queue.join()
+    await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+
+    await main.user_writer.stop()
+    await main.activity_counters.stop()
+    await main.chat_state.stop()
+    await storage.close()
+    await app.stop()
+    await app.shutdown()
+    processor.do_process_update = original
+
+    update_times.sort()
+    return {
+        "updates": len(updates),
+        "seconds": round(elapsed, 4),
+        "updates_per_second": round(len(updates) / elapsed, 1),
+        "p50_ms": round(percentile(update_times, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(update_times, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(update_times, 0.99) * 1000, 3),
+        "db_round_trips_per_update": round(storage.round_trips / len(updates), 4),
+        "api_calls_per_update": round(sum(api.calls.values()) / len(updates), 4),
+        "handlers": {
+            name: {
+                "calls": len(times),
+                "p50_ms": round(percentile(sorted(times), 0.50) * 1000, 3),
+                "p99_ms": round(percentile(sorted(times), 0.99) * 1000, 3),
+            }
+            for name, times in sorted(handler_times.items())
+        },
+    }
+
+
+def previous_result(path, params):
+    try:
+        with open(path, encoding="utf-8") as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return None
+    return next((run for run in reversed(runs) if run.get("params") == params), None)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", help="JSONL file with recorded updates (default: synthetic stream)")
+    parser.add_argument("--updates", type=int, default=5000, help="number of synthetic updates")
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency, ms")
+    parser.add_argument("--storage", choices=("sqlite", "memory"), default="sqlite",
+                        help="users table backend (default: a throwaway SQLite file)")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="simulated latency of --storage memory, ms")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench_output.txt"))
+    parser.add_argument("--verbose", action="store_true", help="show the bot's log output")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        # Log records are still formatted and written, just not to the terminal
+        for handler in logging.getLogger().handlers:
+            handler.setStream(open(os.devnull, "w"))
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            raw_updates = [json.loads(line) for line in f if line.strip()]
+    else:
+        raw_updates = synthetic_updates(args.updates, args.chats, args.users, args.seed)
+
+    params = {
+        "input": os.path.basename(args.input) if args.input else "synthetic",
+        "updates": len(raw_updates),
+        "chats": args.chats,
+        "users": args.users,
+        "seed": args.seed,
+        "api_latency_ms": args.api_latency,
+        "storage": args.storage,
+        "db_latency_ms": args.db_latency,
+        "max_concurrent_updates": main.MAX_CONCURRENT_UPDATES,
+    }
+    random.seed(args.seed)  # Handlers use the random module too
+    result = asyncio.run(replay(raw_updates, args.api_latency / 1000, args.storage, args.db_latency / 1000))
+
+    previous = previous_result(args.output, params)
+    run = {"commit": git_commit(), "time": int(time.time()), "params": params, "result": result}
+    with open(args.output, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+
+    print(f"{result['updates']} updates in {result['seconds']} s: {result['updates_per_second']} updates/s")
+    print(f"latency p50/p95/p99: {result['p50_ms']}/{result['p95_ms']}/{result['p99_ms']} ms")
+    print(f"db round-trips/update: {result['db_round_trips_per_update']}, "
+          f"api calls/update: {result['api_calls_per_update']}")
+    for name, stats in result["handlers"].items():
+        print(f"  {name:16} {stats['calls']:>6} calls  p50 {stats['p50_ms']:8.3f} ms  p99 {stats['p99_ms']:8.3f} ms")
+    if previous:
+        before = previous["result"]
+        change = 100 * (result["updates_per_second"] - before["updates_per_second"]) / before["updates_per_second"]
+        print(f"vs {previous['commit']}: {before['updates_per_second']} -> {result['updates_per_second']} "
+              f"updates/s ({change:+.1f}%), p99 {before['p99_ms']} -> {result['p99_ms']} ms")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,403 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import execute_values
+
+from periodic import PeriodicFlush
+
+# Errors a storage backend may raise for a failed query
+DATABASE_ERRORS = (psycopg2.Error, sqlite3.Error)
+
+SQLITE_SCHEME = "sqlite:///"
+
+
+def _close_when_done(opening, close):
+    """Closes what an abandoned open() still creates once its worker thread finishes"""
+    def done(future):
+        if not future.cancelled() and future.exception() is None:
+            close(future.result())
+    opening.add_done_callback(done)
+
+
+class PostgresStorage:
+    """Shared PostgreSQL connection pool used by every handler.
+
+    Storage backends share one interface: open(), close(), setup(),
+    upsert_users(rows), fetch_users(), add_chat_members(rows),
+    remove_chat_members(rows), fetch_chat_members(), add_user_activity(rows)
+    and fetch_user_activity().
+
+    psycopg2 is blocking, so each query runs in a worker thread and never
+    stalls the event loop. The semaphore keeps the number of in-flight
+    queries at the pool size, because ThreadedConnectionPool raises instead
+    of waiting when it runs out of connections.
+    """
+
+    name = "PostgreSQL"
+
+    def __init__(self, dsn, min_connections=1, max_connections=5):
+        self.dsn = dsn
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self._pool = None
+        self._slots = None
+
+    async def open(self):
+        """Creates the pool (one TLS handshake per pooled connection, not per message)"""
+        if self._pool is not None:
+            return
+        self._slots = asyncio.Semaphore(self.max_connections)
+        opening = asyncio.ensure_future(asyncio.to_thread(
+            pool.ThreadedConnectionPool,
+            self.min_connections,
+            self.max_connections,
+            self.dsn,
+            sslmode="require",  # Force secure connection
+        ))
+        try:
+            self._pool = await asyncio.shield(opening)
+        except asyncio.CancelledError:
+            _close_when_done(opening, pool.ThreadedConnectionPool.closeall)
+            raise
+
+    async def close(self):
+        if self._pool is None:
+            return
+        await asyncio.to_thread(self._pool.closeall)
+        self._pool = None
+
+    def _execute(self, work):
+        conn = self._pool.getconn()
+        broken = False
+        try:
+            with conn.cursor() as cursor:
+                result = work(cursor)
+            conn.commit()
+            return result
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True  # Dropped connection, don't hand it out again
+            raise
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+        except BaseException:
+            broken = True
+            raise
+        finally:
+            self._pool.putconn(conn, close=broken)
+
+    async def run(self, work):
+        """Runs work(cursor) on a pooled connection in a worker thread and commits"""
+        if self._pool is None:
+            raise RuntimeError("PostgresStorage.open() was not awaited")
+        async with self._slots:
+            return await asyncio.to_thread(self._execute, work)
+
+    async def setup(self):
+        """Creates the users, chat_members and user_activity tables if they don't exist"""
+        await self.run(lambda cursor: cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                username TEXT,
+                first_name TEXT
+            );
+            CREATE TABLE IF NOT EXISTS chat_members (
+                chat_id BIGINT,
+                user_id BIGINT,
+                PRIMARY KEY (chat_id, user_id)
+            );
+            CREATE TABLE IF NOT EXISTS user_activity (
+                chat_id BIGINT,
+                user_id BIGINT,
+                messages BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (chat_id, user_id)
+            );
+        """))
+
+    async def upsert_users(self, rows):
+        """Inserts or updates many (user_id, username, first_name) rows in one statement"""
+        if not rows:
+            return
+        await self.run(lambda cursor: execute_values(cursor, """
+            INSERT INTO users (user_id, username, first_name)
+            VALUES %s
+            ON CONFLICT(user_id)
+            DO UPDATE SET username=EXCLUDED.username, first_name=EXCLUDED.first_name;
+        """, rows, page_size=len(rows)))
+
+    async def fetch_users(self):
+        def work(cursor):
+            cursor.execute("SELECT user_id, username, first_name FROM users")
+            return cursor.fetchall()
+        return await self.run(work)
+
+    async def add_chat_members(self, rows):
+        """Stores many (chat_id, user_id) memberships in one statement"""
+        if not rows:
+            return
+        await self.run(lambda cursor: execute_values(cursor, """
+            INSERT INTO chat_members (chat_id, user_id)
+            VALUES %s
+            ON CONFLICT DO NOTHING;
+        """, rows, page_size=len(rows)))
+
+    async def remove_chat_members(self, rows):
+        if not rows:
+            return
+        await self.run(lambda cursor: execute_values(cursor, """
+            DELETE FROM chat_members
+            USING (VALUES %s) AS gone (chat_id, user_id)
+            WHERE chat_members.chat_id = gone.chat_id AND chat_members.user_id = gone.user_id;
+        """, rows, page_size=len(rows)))
+
+    async def fetch_chat_members(self):
+        def work(cursor):
+            cursor.execute("SELECT chat_id, user_id FROM chat_members")
+            return cursor.fetchall()
+        return await self.run(work)
+
+    async def add_user_activity(self, rows):
+        """Adds (chat_id, user_id, messages) deltas to the stored counters in one statement"""
+        if not rows:
+            return
+        await self.run(lambda cursor: execute_values(cursor, """
+            INSERT INTO user_activity (chat_id, user_id, messages)
+            VALUES %s
+            ON CONFLICT(chat_id, user_id)
+            DO UPDATE SET messages=user_activity.messages + EXCLUDED.messages;
+        """, rows, page_size=len(rows)))
+
+    async def fetch_user_activity(self):
+        def work(cursor):
+            cursor.execute("SELECT chat_id, user_id, messages FROM user_activity")
+            return cursor.fetchall()
+        return await self.run(work)
+
+
+class SqliteStorage:
+    """Embedded SQLite database for small deployments and local load tests.
+
+    One long-lived connection in WAL mode, used only from a single worker
+    thread: queries never block the event loop and never run concurrently.
+    Statements are fixed strings, so sqlite3's statement cache keeps them
+    prepared, and a batch of upserts is one transaction.
+    """
+
+    name = "SQLite"
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._executor = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, one fsync per checkpoint
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        opening = asyncio.get_running_loop().run_in_executor(executor, self._connect)
+        try:
+            self._conn = await asyncio.shield(opening)
+        except BaseException:
+            _close_when_done(opening, sqlite3.Connection.close)
+            executor.shutdown(wait=False)
+            raise
+        self._executor = executor
+
+    async def close(self):
+        if self._conn is None:
+            return
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+        self._executor.shutdown(wait=True)
+        self._conn = None
+        self._executor = None
+
+    def _execute(self, work):
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            result = work(cursor)
+            cursor.execute("COMMIT")
+            return result
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    async def run(self, work):
+        """Runs work(cursor) in one transaction on the SQLite worker thread"""
+        if self._conn is None:
+            raise RuntimeError("SqliteStorage.open() was not awaited")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, work)
+
+    async def setup(self):
+        """Creates the users, chat_members and user_activity tables if they don't exist"""
+        def work(cursor):
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS chat_members (
+                    chat_id INTEGER,
+                    user_id INTEGER,
+                    PRIMARY KEY (chat_id, user_id)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_activity (
+                    chat_id INTEGER,
+                    user_id INTEGER,
+                    messages INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (chat_id, user_id)
+                );
+            """)
+        await self.run(work)
+
+    async def upsert_users(self, rows):
+        """Inserts or updates many (user_id, username, first_name) rows in one transaction"""
+        if not rows:
+            return
+        await self.run(lambda cursor: cursor.executemany("""
+            INSERT INTO users (user_id, username, first_name)
+            VALUES (?, ?, ?)
+            ON CONFLICT(user_id)
+            DO UPDATE SET username=excluded.username, first_name=excluded.first_name;
+        """, rows))
+
+    async def fetch_users(self):
+        def work(cursor):
+            cursor.execute("SELECT user_id, username, first_name FROM users")
+            return cursor.fetchall()
+        return await self.run(work)
+
+    async def add_chat_members(self, rows):
+        """Stores many (chat_id, user_id) memberships in one transaction"""
+        if not rows:
+            return
+        await self.run(lambda cursor: cursor.executemany("""
+            INSERT INTO chat_members (chat_id, user_id)
+            VALUES (?, ?)
+            ON CONFLICT DO NOTHING;
+        """, rows))
+
+    async def remove_chat_members(self, rows):
+        if not rows:
+            return
+        await self.run(lambda cursor: cursor.executemany("""
+            DELETE FROM chat_members WHERE chat_id = ? AND user_id = ?;
+        """, rows))
+
+    async def fetch_chat_members(self):
+        def work(cursor):
+            cursor.execute("SELECT chat_id, user_id FROM chat_members")
+            return cursor.fetchall()
+        return await self.run(work)
+
+    async def add_user_activity(self, rows):
+        """Adds (chat_id, user_id, messages) deltas to the stored counters in one transaction"""
+        if not rows:
+            return
+        await self.run(lambda cursor: cursor.executemany("""
+            INSERT INTO user_activity (chat_id, user_id, messages)
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id, user_id)
+            DO UPDATE SET messages=user_activity.messages + excluded.messages;
+        """, rows))
+
+    async def fetch_user_activity(self):
+        def work(cursor):
+            cursor.execute("SELECT chat_id, user_id, messages FROM user_activity")
+            return cursor.fetchall()
+        return await self.run(work)
+
+
+def create_storage(url):
+    """Picks the backend from the URL: sqlite:///relative.db, sqlite:////absolute.db or a PostgreSQL DSN"""
+    if url.startswith(SQLITE_SCHEME):
+        return SqliteStorage(url[len(SQLITE_SCHEME):] or ":memory:")
+    return PostgresStorage(url)
+
+
+class UserWriteBehind:
+    """Buffers user upserts and membership changes and flushes them in bulk.
+
+    Pending rows are merged per user_id, so a user who writes ten messages
+    between flushes costs one row; membership changes are merged per
+    (chat_id, user_id) and the last one wins. A flush happens every
+    flush_interval seconds, or sooner once max_batch changes are waiting.
+    """
+
+    def __init__(self, storage, flush_interval=2.0, max_batch=200):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._pending = {}
+        self._members = {}  # (chat_id, user_id) -> True when joined, False when left
+        self._timer = PeriodicFlush(self.flush, flush_interval)
+
+    @property
+    def pending(self):
+        return len(self._pending) + len(self._members)
+
+    def enqueue(self, user_id, username, first_name):
+        self._pending[user_id] = (user_id, username, first_name)
+        if self.pending >= self.max_batch:
+            self._timer.wake()
+
+    def enqueue_member(self, chat_id, user_id, joined=True):
+        self._members[(chat_id, user_id)] = joined
+        if self.pending >= self.max_batch:
+            self._timer.wake()
+
+    async def flush(self):
+        if not self._pending and not self._members:
+            return
+        batch, self._pending = self._pending, {}
+        members, self._members = self._members, {}
+        try:
+            joined = [key for key, present in members.items() if present]
+            left = [key for key, present in members.items() if not present]
+            if batch:
+                await self.storage.upsert_users(list(batch.values()))
+            if joined:
+                await self.storage.add_chat_members(joined)
+            if left:
+                await self.storage.remove_chat_members(left)
+            logging.info(f"✅ Flushed {len(batch)} user(s) and {len(members)} membership change(s) to the database.")
+        except (*DATABASE_ERRORS, RuntimeError) as e:
+            self._requeue(batch, members)
+            logging.error(f"❌ Database error: {e}")
+        except asyncio.CancelledError:
+            self._requeue(batch, members)  # Writes are idempotent, the next flush repeats them
+            raise
+
+    def _requeue(self, batch, members):
+        # Put the batch back without overwriting anything newer that arrived meanwhile
+        for user_id, row in batch.items():
+            self._pending.setdefault(user_id, row)
+        for key, present in members.items():
+            self._members.setdefault(key, present)
+
+    def start(self):
+        self._timer.start()
+
+    async def stop(self):
+        """Stops the timer and writes out whatever is still pending"""
+        await self._timer.stop()
+        await self.flush()
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+# PTB's own semaphore must never be the one that blocks: it is taken before we know the chat
+UNLIMITED = 2 ** 31 - 1
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different chats concurrently, one at a time per chat.
+
+    Every update first takes its chat's lock and only then one of the
+    max_concurrent_updates slots. The Application starts one task per update
+    in arrival order and asyncio locks are FIFO, so updates of the same chat
+    run strictly in order, while a slow chat never holds more than one slot.
+    Updates without a chat (e.g. inline queries) only need a slot.
+
+    Everything happens in do_process_update, the documented extension point;
+    the base class is given a limit it never reaches.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(UNLIMITED)
+        self.concurrency_limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> lock
+        self._chat_waiters = {}  # chat_id -> updates holding or waiting for the lock
+        self.in_flight = 0
+        self.waiting = 0  # updates that arrived but haven't started yet
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def average_wait(self):
+        return self.total_wait / self.processed if self.processed else 0.0
+
+    def stats(self):
+        return {
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "max_concurrent": self.concurrency_limit,
+            "processed": self.processed,
+            "average_wait": self.average_wait,
+            "max_wait": self.max_wait,
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def _run(self, coroutine, arrived):
+        async with self._slots:
+            waited = time.monotonic() - arrived
+            self.processed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.waiting -= 1
+            self.in_flight += 1
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+                self.waiting += 1  # do_process_update decrements it once more when we return
+
+    async def do_process_update(self, update, coroutine):
+        arrived = time.monotonic()
+        self.waiting += 1
+        try:
+            chat = update.effective_chat if isinstance(update, Update) else None
+            if chat is None:
+                await self._run(coroutine, arrived)
+                return
+
+            chat_id = chat.id
+            lock = self._chat_locks.get(chat_id)
+            if lock is None:
+                lock = self._chat_locks[chat_id] = asyncio.Lock()
+            self._chat_waiters[chat_id] = self._chat_waiters.get(chat_id, 0) + 1
+            try:
+                async with lock:
+                    await self._run(coroutine, arrived)
+            finally:
+                remaining = self._chat_waiters[chat_id] - 1
+                if remaining:
+                    self._chat_waiters[chat_id] = remaining
+                else:
+                    del self._chat_waiters[chat_id]
+                    del self._chat_locks[chat_id]
+        finally:
+            self.waiting -= 1
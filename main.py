@@ -1,14 +1,30 @@
 import os
-import psycopg2
 import re
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
+from telegram import (Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle,
+                      InputTextMessageContent)
+from telegram.ext import (Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler,
+                          InlineQueryHandler)
 import random
 import time
-import json
-import urllib.request
 import asyncio
+import contextlib
+import httpx
+from db import SQLITE_SCHEME, UserWriteBehind, create_storage
+from registry import UserRegistry
+from media import MediaCache, photo_file_id, sticker_file_id
+from assets import AssetLibrary, load_folder_entries
+from variants import CARD_PACK_PATH, load_or_build_pack
+from matcher import TriggerMatcher, DISPUTE, ZELDA, TAG_ALL, MANUAL_DISPUTE
+from activity import ActivityTracker
+from state import ChatStateStore
+from dispatch import PerChatUpdateProcessor
+from outbound import PriorityRateLimiter, SendDropped, HIGH_PRIORITY, LOW_PRIORITY
+from metrics import Metrics, TimedStorage, start_metrics_server
+from teas import TeaCatalog, RANDOM_CATEGORY, NOT_FOUND
+from stats import ActivityCounters
+
+STARTED_AT = time.perf_counter()  # For the startup timing report
 
 # GitHub repo config
 GITHUB_USERNAME = "TaikiB0t"
@@ -19,45 +35,73 @@ GITHUB_BRANCH = "main"
 BASE_CARD_URL = f"https://raw.githubusercontent.com/{GITHUB_USERNAME}/{GITHUB_REPO}/{GITHUB_BRANCH}/mistchypark/"
 BASE_STICKER_URL = f"https://raw.githubusercontent.com/{GITHUB_USERNAME}/{GITHUB_REPO}/{GITHUB_BRANCH}/zeldafaces/"
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # GitHub API endpoints for folder contents
 CARDS_API_URL = f"https://api.github.com/repos/{GITHUB_USERNAME}/{GITHUB_REPO}/contents/mistchypark"
 STICKERS_API_URL = f"https://api.github.com/repos/{GITHUB_USERNAME}/{GITHUB_REPO}/contents/zeldafaces"
 
-# Function to fetch filenames from GitHub folder using API
-def get_image_filenames_from_github(api_url):
-    try:
-        with urllib.request.urlopen(api_url) as response:
-            data = json.load(response)
-            return [
-                item["name"]
-                for item in data
-                if item["type"] == "file" and item["name"].lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
-            ]
-    except Exception as e:
-        print(f"❌ Failed to load from GitHub API: {e}")
-        return []
+# Optional background re-listing of the folders on GitHub (seconds, 0 = never)
+ASSET_REFRESH_INTERVAL = int(os.getenv("ASSET_REFRESH_INTERVAL", "0"))
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")  # Optional, raises the API rate limit
 
+# ✅ Cards and stickers come from the local assets_manifest.json (loaded during startup), GitHub is never needed
+BRIDGE_OR_PARK_CARDS = AssetLibrary("mistchypark", BASE_CARD_URL, CARDS_API_URL, base_dir=BASE_DIR)
+ZELDA_FACE_STICKERS = AssetLibrary("zeldafaces", BASE_STICKER_URL, STICKERS_API_URL, base_dir=BASE_DIR)
 
-# ✅ One-time load at startup
-card_files = get_image_filenames_from_github(CARDS_API_URL)
-sticker_files = get_image_filenames_from_github(STICKERS_API_URL)
-print(f"✅ Loaded {len(card_files)} card images")
-print(f"✅ Loaded {len(sticker_files)} sticker images")
+# ✅ Size-optimized, deduplicated card variants (mistchypark.pack), built in the background on startup
+card_pack = None
 
-# Full public URLs to use in bot commands
-BRIDGE_OR_PARK_CARDS = [BASE_CARD_URL + filename for filename in card_files]
-ZELDA_FACE_STICKERS = [BASE_STICKER_URL + filename for filename in sticker_files]
+# ✅ Telegram file_ids of already sent cards/stickers, so GitHub is hit only once per image
+MEDIA_CACHE_PATH = os.getenv("MEDIA_CACHE_PATH", os.path.join(BASE_DIR, "media_cache.json"))
+media_cache = MediaCache(MEDIA_CACHE_PATH)
 
-# Enable logging to debug user tracking
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# Enable logging to debug user tracking (LOG_LEVEL=DEBUG also logs every received message)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+logging.getLogger("httpx").setLevel(logging.WARNING)  # One INFO line per Bot API request otherwise
 
 TOKEN = os.getenv("BOT_TOKEN")  # Use environment variable for security
 
-# Get PostgreSQL connection URL from Railway environment variables
+# PostgreSQL connection URL from Railway environment variables, or sqlite:///path/to/file.db
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 if not DATABASE_URL:
-    raise ValueError("❌ DATABASE_URL is not set! Add it in Railway's environment variables.")
+    DATABASE_URL = SQLITE_SCHEME + os.path.join(BASE_DIR, "users.db")
+    logging.warning(f"⚠️ DATABASE_URL is not set, using the embedded database at {DATABASE_URL}")
+
+# ✅ Handler, database and Bot API timings; served on METRICS_PORT if set
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+metrics = Metrics()
+
+# ✅ One pool (or one SQLite connection) for the whole process, opened at startup
+storage = TimedStorage(create_storage(DATABASE_URL), metrics)
+# ✅ User upserts are merged per user and written in batches
+user_writer = UserWriteBehind(storage)
+# ✅ Known users, warmed from the database at startup
+user_registry = UserRegistry()
+# ✅ Messages per user per chat for /stats, saved as batched deltas
+STATS_TOP_SIZE = 10
+activity_counters = ActivityCounters(storage, top_size=STATS_TOP_SIZE)
+# ✅ Set once the first connection attempt finished, and once the registry is warmed from the database
+database_attempted = asyncio.Event()
+database_ready = asyncio.Event()
+DATABASE_READY_TIMEOUT = 10  # How long @all waits for the registry right after a restart
+DATABASE_RETRY_DELAYS = (1, 60)  # An unreachable database is retried after 1 s, doubling up to 60 s
+# ✅ @all is split into messages Telegram accepts: 4096 characters, and only 50 mentions notify
+MENTION_MESSAGE_CHARS = 4096
+MENTIONS_PER_MESSAGE = 50
+
+# ✅ Webhook mode: set WEBHOOK_URL (public https base URL) to get updates pushed instead of polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Checked against Telegram's X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+PORT = int(os.getenv("PORT", "8443"))  # Railway sets PORT for web services
+# ✅ The update types our handlers use, requested the same way in webhook and polling mode
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    raise ValueError("❌ WEBHOOK_SECRET is not set! It is required together with WEBHOOK_URL.")
 
 # ✅ List of admin user IDs (replace with actual Telegram user IDs)
 # Load from Railway environment
@@ -65,21 +109,41 @@ admin_env = os.getenv("BOT_ADMINS", "")
 # Parse the comma-separated string into a list of integers
 BOT_ADMINS = [int(uid.strip()) for uid in admin_env.split(",") if uid.strip().isdigit()]
 
-# ✅ Replace with your actual Telegram group ID
-TARGET_GROUP_ID = os.getenv("TARGET_GROUP_ID")
-TEST_GROUP_ID = os.getenv("TEST_GROUP_ID")
 
-# ✅ Store recent messages
-recent_messages = []
+def parse_chat_id(value):
+    """Chat IDs from the environment are strings; Telegram gives us ints (groups are negative)"""
+    value = (value or "").strip()
+    return int(value) if value.lstrip("-").isdigit() else None
 
-# ✅ Store the last time the bot triggered #срач
-last_dispute_time = 0
+
+# ✅ Replace with your actual Telegram group ID
+TARGET_GROUP_ID = parse_chat_id(os.getenv("TARGET_GROUP_ID"))
+TEST_GROUP_ID = parse_chat_id(os.getenv("TEST_GROUP_ID"))
+
+# ✅ Groups where #срач detection runs (comma-separated, defaults to the target group)
+DISPUTE_CHAT_IDS = {
+    chat_id for chat_id in map(parse_chat_id, os.getenv("DISPUTE_CHAT_IDS", "").split(","))
+    if chat_id is not None
+} or {chat_id for chat_id in (TARGET_GROUP_ID,) if chat_id is not None}
 
 # ✅ Time limits (in seconds)
 DISPUTE_TIMEOUT = 3600  # 1 hour (3600 seconds)
 MESSAGE_WINDOW = 300  # 5 minutes (300 seconds)
 MIN_MESSAGES = 20  # Minimum messages in the last 5 minutes
 
+# ✅ Recent messages and the last #срач, tracked separately for every chat
+chat_activity = ActivityTracker(MESSAGE_WINDOW, MIN_MESSAGES, DISPUTE_TIMEOUT)
+# ✅ ...and kept across restarts (STATE_PATH.bin snapshot + STATE_PATH.journal)
+STATE_PATH = os.getenv("STATE_PATH", os.path.join(BASE_DIR, "chat_state"))
+chat_state = ChatStateStore(STATE_PATH, chat_activity)
+
+# ✅ How many updates are handled at once; updates of the same chat still run in order
+MAX_CONCURRENT_UPDATES = max(1, int(os.getenv("MAX_CONCURRENT_UPDATES", "16")))
+update_processor = PerChatUpdateProcessor(MAX_CONCURRENT_UPDATES)
+
+# ✅ Every Bot API call goes through global and per-chat flood control
+rate_limiter = PriorityRateLimiter(observe=metrics.observe_api)
+
 # ✅ List of dispute-triggering phrases (Ukrainian)
 DISPUTE_PHRASES = [
     "неправий", "неправа", "не правий", "не права", "непогоджуюсь", "не погоджуюсь",
@@ -89,84 +153,126 @@ DISPUTE_PHRASES = [
     "на свій рахунок", "вибач", "мене заділо", "але згодна", "я не люблю"
 ]
 
+# ✅ Dispute phrases, Zelda keywords, @all and #срач are detected in one pass
+TRIGGERS = TriggerMatcher(DISPUTE_PHRASES)
+
 # ✅ Set your chance here (e.g. 30 means 30% chance to react)
 RESPONSE_CHANCE_PERCENT = 50
 
-# ✅ All teas in Dzhokonda's menue.
-TEAS = {
-    "Вогняне танго": ("Чорні", "Чарівна суміш чорного чаю, кориці та рожевого перцю. Пряний та пікантний смак балансується мʼяким цитрусовим ароматом."),
-    "З бергамотом": ("Чорні", "За однією з версій, під час шторму на англійському судні бочки з олією бергамоту перекинулись і зіпсували чай. Проте він прийшовся до смаку."),
-    "Золотий равлик": ("Чорні", "Вишуканий чорний чай з провінції Хунань. Винятково молоді чайні тіпси та два наймолодші верхні чайні листи."),
-    "Лавандова ніч": ("Чорні", "Мікс чорного чаю що переплітається з пʼянким ароматом квітів лаванди, цедри апельсина та лимона, освіжаючими відтінками листя мʼяти та моринги."),
-    "Може гострити": ("Чорні", "Це суміш чорного чаю, цедри апельсина та шматочків імбиру. Відомий як тонізуючий та антиоксидантний напій."),
-    "Тандем апельсину та вишні": ("Чорні", "Відбірний цейлонський чай в поєднанні зі шматочками апельсина та вишні, з додаванням пелюстків квітів апельсина та жасмину."),
-    "Цейлонський": ("Чорні", "Цейлонський чорний чай найвищого ґатунку. Класичний смак високогірного чаю зі свіжим ароматом."),
-    "Чері-чері": ("Чорні", "Справжній подарунок для поціновувачів вишневих насолод: з додаванням шматочків вишні та ароматом вишневої кісточки."),
-    "Зелений равлик": ("Зелені", "Класичний плантаційний чай з провінції Хунань. Виготовлено з молодого листя зеленого чаю, згорнутого по спіралі."),
-    "Калейдоскоп.": ("Зелені", "Це гармонійне поєднання ніжного зеленого чаю зі шматочками ананаса, ягодами смородини та пелюстками квітів."),
-    "Ліс-Беррі": ("Зелені", "Справжній лісовий смак: цейлонський зелений чай з додаванням кишмишу, листям чорної смородини та ягодами малини, чорниці, журавлини й ожини."),
-    "Пан Жасмин": ("Зелені", "Вигатовляють за ритуалом відомим як 'Весілля', під час якого свіжі квіти жасмину змішують з зеленим чаєм, а потім мʼяко запарюють."),
-    "Фламінго": ("Зелені", "Як яскраві птахи, він вражає пелюстками сафлору, соняшника та волошки, що доповнені ароматами бергамоту та лимону."),
-    "Чайна казка": ("Зелені", "Основа з ніжного зеленого чаю збагачена соковитими шматочками апельсина, папайї та шипшини, а пелюстки гібіскусу додають композиції елегантності."),
-    "Бурштинка": ("Травʼяні", "Цей сонячний букет із квітів та ягід тамує спрагу та наповнює організм цілющим теплом. Говорять що він захищає та допомагає у разі застуди, коли болить горло та втрачається голос."),
-    "Грецький гірський": ("Травʼяні", "Грецький гірський чай (Sideritis Scardica) вже в давнину цінувався як лікарська рослина. Він має свіжий, солодкий аромат з відтінком лимона та кориці, неповторний квітково-землистий настій."),
-    "Гуаюса": ("Травʼяні", "Це натуральний напій з Еквадору, що поєднує кофеїн та теобромін. Має мʼякий вплив і солодкуватий, горіховий смак."),
-    "Імбирний": ("Травʼяні", "Має яскравий смак і теплу пряність імбиру. Цей чай не лише зігріває взимку, але й відомий своїми корисними властивостями."),
-    "Кора та корінь": ("Травʼяні", "Глибокий, як древній ліс, та яскравий, як полумʼя. Деревні ноти лапачо та сандалу поєднуються з теплом імбиру на базі ройбушу."),
-    "Лабіринт": ("Травʼяні", "Бленд чорного та зеленого чаїв з ягодами шипшини, бузини та чорниці, квітами ромашки, лимоннику та мʼяти, листям ожини."),
-    "Медовий куш": ("Травʼяні", "Це чай з листя та квітів дикого південноафриканського чагарника ханібушу. Спробуйте смак, що поєднує аромати меду, кориці, груші."),
-    "Червоний куш": ("Травʼяні", "Витончені солодкі карамельні нотки південноафриканського ройбоса із додаванням шматочків макадамського горіху та білого шоколаду."),
-    "Шалена буря": ("Травʼяні", "Суміш, де ройбос поєднується із шматочками яблука, коренем женьшеню, імбирем, листям омели, чорним перцем та корицею."),
-    "З міста Пуер": ("Пуери", "Хороші речі вимагають часу - подібно до сиру та використовується повільний процес ферментації, що вимагає витримки не менше пʼяти років."),
-    "Пресований міні-туоча (зелений / чорний)": ("Пуери", "🌚."),
-    "Рисовий привид (пресований)": ("Пуери", "Прислухайтеся: крізь густий, деревно-горіховий смак пробивається солодкий шепіт рисових полів. Аромат трави Номісян дарує напою затишний характер та нескінченно довгий, зігріваючий післясмак."),
-    "Таємний Юньнань": ("Пуери", "Це не просто чай, а запрошення до відкриття. Витриманий Шу Пу Ер з пелюстками троянди та полунично-вершковим ароматом дарує нові враження з кожним ковтком."),
-    "Чорний Чжутун (пресований)": ("Пуери", "Дянь Хун Чжутун — відбірний пресований чорний чай у бамбуковому листу. Медово-солодкий смак з легким вʼязким відтінком. Ідеальне задоволення в кожному ковтку!"),
-    "Джоконда": ("Фруктові", "Це запашний букет із квітів та ягід. Немов занурюєшся у лісову гущавину, тебе обдають такі знайомі запахи. Терпкий смак літа."),
-    "Нахаба": ("Фруктові", "Апетитні шматочки папайї, яблука, смородини та гібіскусу. Довершений смак формують шипшина, бузина та родзинки."),
-    "Подорож до Тибету": ("Фруктові", "Композиція чорного та зеленого чаїв, що обʼєднує в собі магію ягід годжі, квітів гранату та жасмину, шматочків малини та порічки."),
-    "Таємниця двох світів": ("Фруктові", "Суміш чорного байхового чаю (пеко) та зеленого вʼєтнамського чаю, зі шматочками мʼякого манго, папайї, пелюстками соняшника."),
-    "Фруктово-мʼятний": ("Фруктові", "Приємний заспокійливий аромат мʼяти, відтінено тонким фруктовим присмаком. Ніжний, грає апельсиновими нотками."),
-    "Ягідний етюд": ("Фруктові", "Поєднання натуральних скарбів природи: кишмишу, каркаде, шипшини, ягід обліпихи, листя родовика, малини, суниці, ожини."),
-    "Білий чай": ("Особливі", "Відчуйте свіжий подих весняних гір Фуцзяню у кожному ковтку. Прозорий настій шепоче свіжістю, розкриваючи ніжний квітковий аромат та оксамитовий, делікатний смак."),
-    "Гречаний": ("Особливі", "Легке та ніжне на смак, багате на вітаміни молоде насіння татарської гречихи, нагадує про теплі осінні дні та натуральну свіжість."),
-    "Синій чай": ("Особливі", "Також відомий як Анчан, вважається, що він не лише має вишуканий смак, але й допомагає схуднути, йому наділяють омолоджувальний ефект. Маєте нагоду перевірити!"),
-    "Улун": ("Особливі", "Має гладку кремову консистенцію, насичений вершковий аромат і солодкуватий присмак з легкими квітковими нотками. Чайне листя з кислинкою, за кольором та смаком середній між чорним та зеленим чаєм."),
-    "Квітка пустелі": ("Літні", "Яскраво-червоний настій з пелюсток суданської троянди (гібіскуса), що бадьорить. Відчуйте освіжаючий дотик Сходу."),
-    "Морозні ягоди.": ("Літні", "Соковиті ягоди, ніби вкриті памороззю мʼятної свіжості. Освіжаючий арктичний бриз, що дарує прохолоду та гармонію."),
-    "Ніжний дотик.": ("Літні", "Елегантний китайський зелений чай, зібраний у квітні. Його світло-золотавий колір і мʼякий смак створюють атмосферу весняного пробудження."),
-    "Сонячний сад": ("Літні", "Ваша рятівна прохолода посеред спекотного дня. Соковитий та освіжаючий, немов тінистий куточок у квітучому саду."),
-    "Тропічна прохолода.": ("Літні", "Тропічний вибух смаків! Ананас, манго, апельсин, мандарин та полуниця з пелюстками сафлору й календули."),
-    "Cуп": ("Особливі", "Хіба це не чай?🌚"),
-}
-TEA_CATEGORIES = [
-    "Чорні",
-    "Зелені",
-    "Травʼяні",
-    "Пуери",
-    "Фруктові",
-    "Особливі",
-    "Літні"
-]
+# ✅ All teas in Dzhokonda's menu, reloaded when dzhokonda.txt changes
+TEA_CATALOG = TeaCatalog(os.path.join(BASE_DIR, "dzhokonda.txt"))
+TEA_SEARCH_RESULTS = 20
+
+
+async def connect_database():
+    """Opens the database, creates the tables if they don't exist and warms the registry"""
+    await storage.open()
+    await storage.setup()
+    users = await storage.fetch_users()
+    user_registry.load(users)
+    members = await storage.fetch_chat_members()
+    if not members and TARGET_GROUP_ID is not None:
+        # Before membership was tracked, everybody we knew was in the target group
+        members = [(TARGET_GROUP_ID, user_id) for user_id, _, _ in users]
+        await storage.add_chat_members(members)
+        logging.info(f"✅ Added {len(members)} known user(s) to the members of {TARGET_GROUP_ID}")
+    user_registry.load_members(members)
+    activity_counters.load(await storage.fetch_user_activity())
+    print(f"✅ {storage.name} Database initialized successfully ({len(user_registry)} users known).")
+
+
+async def setup_database():
+    """Connects to the database, retrying with backoff until it is reachable"""
+    delay, max_delay = DATABASE_RETRY_DELAYS
+    while True:
+        try:
+            await connect_database()
+            break
+        except Exception as e:
+            print(f"❌ Database error: {e} (retrying in {delay} s)")
+        database_attempted.set()  # Handlers stop waiting and use what was seen since startup
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_delay)
+    database_attempted.set()
+    database_ready.set()
+    # Writes that queued up meanwhile go out now; the counters were loaded on top of them first
+    user_writer.start()
+    activity_counters.start()
+
+
+async def wait_for_database(fallback):
+    """Right after a restart, gives the registry a moment to be warmed from the database"""
+    if not database_attempted.is_set():
+        try:
+            await asyncio.wait_for(database_attempted.wait(), timeout=DATABASE_READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+    if not database_ready.is_set():
+        logging.warning(f"⚠️ Database is not ready yet, {fallback}.")
+
+
+async def load_assets():
+    """Reads the card/sticker manifest and the tea menu off the event loop"""
+    cards, stickers, teas = await asyncio.gather(
+        asyncio.to_thread(load_folder_entries, "mistchypark", BASE_DIR),
+        asyncio.to_thread(load_folder_entries, "zeldafaces", BASE_DIR),
+        TEA_CATALOG.refresh(),
+    )
+    BRIDGE_OR_PARK_CARDS.load(cards)
+    ZELDA_FACE_STICKERS.load(stickers)
+    print(f"✅ Loaded {len(BRIDGE_OR_PARK_CARDS)} card images")
+    print(f"✅ Loaded {len(ZELDA_FACE_STICKERS)} sticker images")
+    print(f"✅ Loaded {len(teas)} teas")
+
 
+async def restore_chat_state():
+    """Brings back activity windows and #срач cooldowns, then keeps saving them"""
+    await chat_state.restore()
+    chat_state.start()
 
-def setup_database():
-    """Creates the users table if it doesn't exist"""
+
+async def timed_step(name, coroutine, timings):
+    started = time.perf_counter()
     try:
-        conn = psycopg2.connect(DATABASE_URL, sslmode="require")  # Force secure connection
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                username TEXT,
-                first_name TEXT
-            );
-        """)
-        conn.commit()
-        conn.close()
-        print("✅ PostgreSQL Database initialized successfully.")
-    except Exception as e:
-        print(f"❌ Database error: {e}")
+        return await coroutine
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+def format_timings(timings):
+    return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items())
+
+
+class BotApplication(Application):
+    """Application that loads the bot's own state while it connects to Telegram.
+
+    The Telegram handshake and asset loading run concurrently and gate the
+    first update. The database is set up in the background: handlers that
+    need it wait for the first connection attempt instead of startup sleeping a
+    fixed time, and an unreachable database is retried until it comes up.
+    """
+
+    async def initialize(self):
+        if "database_setup" in self.bot_data:  # Already initialized
+            return
+        timings = {}
+        database = asyncio.create_task(timed_step("database", setup_database(), timings))
+        database.add_done_callback(
+            lambda task: task.cancelled() or logging.info(f"⏱ Database ready: {format_timings(timings)}"))
+        self.bot_data["database_setup"] = database
+        await asyncio.gather(
+            timed_step("bot handshake", super().initialize(), timings),
+            timed_step("assets", load_assets(), timings),
+            timed_step("chat state", restore_chat_state(), timings),
+        )
+        self.bot_data["first_update_pending"] = True
+        logging.info(f"⏱ Ready {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms after start "
+                     f"({format_timings(timings)})")
+
+    async def process_update(self, update):
+        await super().process_update(update)
+        if self.bot_data.pop("first_update_pending", False):
+            logging.info(f"⏱ First update handled {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms after start")
 
 
 def escape_markdown(text: str) -> str:
@@ -176,8 +282,60 @@ def escape_markdown(text: str) -> str:
     return ""
 
 
+async def load_card_pack():
+    """Opens the card variant pack, building it first if it is missing or out of date"""
+    global card_pack
+    try:
+        card_pack = await asyncio.to_thread(
+            load_or_build_pack, "mistchypark", CARD_PACK_PATH, BRIDGE_OR_PARK_CARDS.assets, BASE_DIR
+        )
+    except Exception as e:
+        logging.error(f"❌ Failed to prepare card variants, sending originals: {e}")
+
+
+async def refresh_assets():
+    """Periodically re-lists the card/sticker folders on GitHub (conditional requests)"""
+    async with httpx.AsyncClient(timeout=10) as client:
+        while True:
+            for library in (BRIDGE_OR_PARK_CARDS, ZELDA_FACE_STICKERS):
+                try:
+                    await library.refresh(client, token=GITHUB_TOKEN)
+                except (httpx.HTTPError, ValueError, KeyError) as e:
+                    logging.error(f"❌ Failed to refresh {library.folder}/ from GitHub API: {e}")
+            await asyncio.sleep(ASSET_REFRESH_INTERVAL)
+
+
+async def post_init(app):
+    """Runs once the bot is initialized, before updates are fetched; nothing here blocks startup"""
+    app.bot_data["card_pack"] = asyncio.create_task(load_card_pack())
+    if ASSET_REFRESH_INTERVAL > 0:
+        app.bot_data["asset_refresh"] = asyncio.create_task(refresh_assets())
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT)
+    app.bot_data["notify_admin"] = asyncio.create_task(notify_admin(app))
+
+
+async def post_shutdown(app):
+    """Writes out buffered users and chat state and closes the pool"""
+    refresh_task = app.bot_data.pop("asset_refresh", None)
+    if refresh_task:
+        refresh_task.cancel()
+    metrics_server = app.bot_data.pop("metrics_server", None)
+    if metrics_server:
+        metrics_server.close()
+    database_setup = app.bot_data.pop("database_setup", None)
+    if database_setup and not database_setup.done():
+        # Still connecting (or waiting to retry); the writers never started in that case
+        database_setup.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await database_setup
+    await user_writer.stop()
+    await activity_counters.stop()
+    await storage.close()
+    await chat_state.stop()
+
+
 async def notify_admin(app):
-    await asyncio.sleep(5)  # optional wait for stability
     if BOT_ADMINS:
         try:
             await app.bot.send_message(chat_id=BOT_ADMINS[0], text="🌞 няв 🌝")
@@ -192,45 +350,29 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def tag_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Mentions all stored users except the sender using @username when possible"""
-    chat = update.effective_chat
+    """Mentions all members of the chat except the sender using @username when possible"""
     sender_id = update.message.from_user.id
 
-    try:
-        # Connect to PostgreSQL
-        conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-        cursor = conn.cursor()
-
-        # Fetch all users from the database
-        cursor.execute("SELECT user_id, username, first_name FROM users")
-        users = cursor.fetchall()
-        conn.close()
-
-        if not users:
-            await update.message.reply_text("I don't know anyone in this group yet! Send some messages first.")
-            return
+    await wait_for_database("tagging the users seen since startup")
 
-        tagged_users = []
-        for user_id, username, first_name in users:
-            if user_id == sender_id:
-                continue
-            if username:
-                tagged_users.append(f"@{username}")
-            else:
-                # fallback to tg://user?id=... link if no username
-                safe_name = first_name or "user"
-                tagged_users.append(f'<a href="tg://user?id={user_id}">{safe_name}</a>')
-
-        if tagged_users:
-            message = "няв " + ", ".join(tagged_users)
-        else:
-            message = "No users found to tag."
+    # Mentions are pre-rendered by the registry, no database round-trip here
+    chat_id = update.message.chat_id
+    if not user_registry.member_count(chat_id):
+        await update.message.reply_text("I don't know anyone in this group yet! Send some messages first.")
+        return
 
-        await update.message.reply_text(message, parse_mode="HTML", reply_to_message_id=update.message.message_id)
+    chunks = user_registry.mention_chunks(chat_id, sender_id, prefix="няв ", max_chars=MENTION_MESSAGE_CHARS,
+                                          max_mentions=MENTIONS_PER_MESSAGE)
+    if not chunks:
+        chunks = ["No users found to tag."]
 
-    except psycopg2.Error as e:
-        await update.message.reply_text("❌ Database error. Please check logs.")
-        logging.error(f"❌ Database error: {e}")
+    # ✅ Mentions are high priority: queued through flood control (which paces the chunks) instead of being lost
+    for number, chunk in enumerate(chunks):
+        await context.bot.send_message(
+            chat_id=chat_id, text=chunk, parse_mode="HTML",
+            reply_to_message_id=update.message.message_id if number == 0 else None,
+            rate_limit_args=HIGH_PRIORITY,
+        )
 
 
 async def speak(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -254,7 +396,7 @@ async def speak(update: Update, context: ContextTypes.DEFAULT_TYPE):
     speak_text = " ".join(context.args)  # Extract text after /speak
 
     try:
-        await context.bot.send_message(chat_id=TARGET_GROUP_ID, text=speak_text)
+        await context.bot.send_message(chat_id=TARGET_GROUP_ID, text=speak_text, rate_limit_args=HIGH_PRIORITY)
         await update.message.reply_text(f"✅ Sent your message to the group:\n\n🔹 {speak_text}")
 
         logging.info(f"Admin {user_id} sent message to group {TARGET_GROUP_ID}: {speak_text}")
@@ -264,6 +406,43 @@ async def speak(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Failed to send the message to the group. Make sure I'm an admin.")
 
 
+async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows update queue depth and wait times to bot admins in private chat"""
+    user_id = update.message.from_user.id
+    if user_id not in BOT_ADMINS or update.message.chat_id != user_id:
+        await update.message.reply_text("няв?")
+        return
+
+    queue_stats = update_processor.stats()
+    await update.message.reply_text(
+        f"📬 queued: {context.application.update_queue.qsize()}\n"
+        f"⏳ waiting: {queue_stats['waiting']}\n"
+        f"⚙️ in flight: {queue_stats['in_flight']}/{queue_stats['max_concurrent']}\n"
+        f"✅ processed: {queue_stats['processed']}\n"
+        f"⏱ wait avg/max: {queue_stats['average_wait'] * 1000:.1f}/{queue_stats['max_wait'] * 1000:.1f} ms\n"
+        f"📤 sent/dropped/flood waits: {rate_limiter.sent}/{rate_limiter.dropped}/{rate_limiter.flood_waits}"
+    )
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats [N]: the most active users of this chat"""
+    limit = STATS_TOP_SIZE
+    if context.args and context.args[0].isdigit():
+        limit = max(1, min(STATS_TOP_SIZE, int(context.args[0])))
+
+    # Counts saved before the restart are loaded with the users
+    await wait_for_database("showing the messages counted since startup")
+    leaders = activity_counters.top(update.message.chat_id, limit)
+    if not leaders:
+        await update.message.reply_text("📊 тут ще тихо 🐾")
+        return
+    lines = [
+        f"{place}. {user_registry.display_name(user_id)} — {messages}"
+        for place, (user_id, messages) in enumerate(leaders, start=1)
+    ]
+    await update.message.reply_text("📊 найактивніші:\n" + "\n".join(lines))
+
+
 async def spies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Generates a random 'Spies' matrix when /spies is used"""
     chat_id = update.message.chat_id
@@ -301,24 +480,32 @@ async def spies(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def bridge_or_park(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a random card from Telegram-hosted images with a random number"""
-    if not BRIDGE_OR_PARK_CARDS:
+    if not BRIDGE_OR_PARK_CARDS.assets:
         await update.message.reply_text("❌ No cards are available.")
         return
 
-    chosen_card = random.choice(BRIDGE_OR_PARK_CARDS)
+    cards = BRIDGE_OR_PARK_CARDS.assets
+    if card_pack:
+        cards = card_pack.unique(cards)  # Skip duplicate photos of the same card
+    card = random.choice(cards)
     chosen_number = random.randint(1, 3)
 
     try:
-        await update.message.reply_photo(photo=chosen_card, caption=f"🔢 {chosen_number}")
+        await media_cache.send(
+            lambda photo: update.message.reply_photo(photo=photo, caption=f"🔢 {chosen_number}"),
+            card.url, card.path, photo_file_id, key=card.sha,
+            data=card_pack.get(card.sha) if card_pack else None,
+        )
     except Exception as e:
         logging.error(f"❌ Failed to send card: {e}")
         await update.message.reply_text("❌ няв 😿")
 
 
 async def tea_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    teas = await TEA_CATALOG.refresh()
     keyboard = [
         [InlineKeyboardButton(text=cat, callback_data=f"tea_{cat}")]
-        for cat in ["Випадковий"] + TEA_CATEGORIES
+        for cat in (RANDOM_CATEGORY,) + teas.categories
     ]
     markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text("няв 🍵?", reply_markup=markup)
@@ -329,37 +516,44 @@ async def tea_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     selected = query.data.replace("tea_", "")
-    if selected == "Випадковий":
-        tea = random.choice(list(TEAS.keys()))
-        category, description = TEAS[tea]
-        header = f"🎲🎲🫖 {tea}"
-    else:
-        filtered_teas = [name for name, (cat, _) in TEAS.items() if cat == selected]
-        tea = random.choice(filtered_teas)
-        category, description = TEAS[tea]
-        if selected == "Чорні":
-            header = f"🎲🍂🫖 {tea}"
-        elif selected == "Зелені":
-            header = f"🎲🍃🫖 {tea}"
-        elif selected == "Травʼяні":
-            header = f"🎲🌱🫖 {tea}"
-        elif selected == "Пуери":
-            header = f"🎲🕰🫖 {tea}"
-        elif selected == "Фруктові":
-            header = f"🎲🫐🫖 {tea}"
-        elif selected == "Особливі":
-            header = f"🎲🌸🫖 {tea}"
-        elif selected == "Літні":
-            header = f"🎲🌞🫖 {tea}"
-        else:
-            header = f"🎲❌🫖 няв😿"
+    teas = await TEA_CATALOG.refresh()
+    await query.edit_message_text(teas.pick(selected) or NOT_FOUND)
+
+
+async def tea_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline mode (@bot лаванд): searches the menu by name"""
+    query = update.inline_query
+    teas = await TEA_CATALOG.refresh()
+    results = [
+        InlineQueryResultArticle(
+            id=str(number),
+            title=f"{tea.emoji} {tea.name}",
+            description=tea.description,
+            input_message_content=InputTextMessageContent(f"{tea.emoji}🫖 {tea.name}\n\n{tea.description}"),
+        )
+        for number, tea in enumerate(teas.search(query.query, limit=TEA_SEARCH_RESULTS))
+    ]
+    await query.answer(results, cache_time=int(TEA_CATALOG.check_interval))
+
 
-    await query.edit_message_text(f"{header}\n\n{description}")
+def track_membership(message):
+    """Keeps chat membership in sync with join and leave service messages"""
+    for member in message.new_chat_members or ():
+        if member.is_bot:
+            continue
+        username = member.username if member.username else "None"
+        first_name = member.first_name if member.first_name else "None"
+        if user_registry.observe(member.id, username, first_name):
+            user_writer.enqueue(member.id, username, first_name)
+        if user_registry.join(message.chat_id, member.id):
+            user_writer.enqueue_member(message.chat_id, member.id)
+    left = message.left_chat_member
+    if left and user_registry.leave(message.chat_id, left.id):
+        user_writer.enqueue_member(message.chat_id, left.id, joined=False)
 
 
 async def track_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Stores users who send messages in the database and detects @all & polls"""
-    global last_dispute_time
     if not update.message:
         return
 
@@ -369,56 +563,48 @@ async def track_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = user.username if user.username else "None"
     first_name = user.first_name if user.first_name else "None"
     text = update.message.text or ""
+    triggers = TRIGGERS.scan(text)
 
-    logging.info(f"🔹 Received message from: ID={user_id}, Username={username}, First Name={first_name}")
+    logging.debug("🔹 Received message from: ID=%s, Username=%s, First Name=%s", user_id, username, first_name)
 
-    try:
-        conn = psycopg2.connect(DATABASE_URL, sslmode="require")
-        cursor = conn.cursor()
-
-        # Insert or update user info
-        cursor.execute("""
-            INSERT INTO users (user_id, username, first_name) 
-            VALUES (%s, %s, %s) 
-            ON CONFLICT(user_id) 
-            DO UPDATE SET username=EXCLUDED.username, first_name=EXCLUDED.first_name;
-        """, (user_id, username, first_name))
-
-        conn.commit()
-        conn.close()
-        logging.info(f"✅ User {user_id} stored in the database.")
-
-    except psycopg2.Error as e:
-        logging.error(f"❌ Database error: {e}")
-
-    # ✅ Detect messages in the target group and track timestamps
-    if chat_id == TARGET_GROUP_ID:
-        current_time = time.time()
-        recent_messages.append(current_time)
+    # Insert or update user info, only when something changed (written in the background by user_writer)
+    if user_registry.observe(user_id, username, first_name):
+        user_writer.enqueue(user_id, username, first_name)
+    if chat_id != user_id:  # Group chats only
+        if user_registry.join(chat_id, user_id):
+            user_writer.enqueue_member(chat_id, user_id)
+        activity_counters.increment(chat_id, user_id)
+        track_membership(update.message)
 
-        # ✅ Remove messages older than 5 minutes
-        recent_messages[:] = [msg_time for msg_time in recent_messages if current_time - msg_time <= MESSAGE_WINDOW]
+    # ✅ Detect messages in the dispute groups and track timestamps
+    if chat_id in DISPUTE_CHAT_IDS:
+        current_time = time.time()
+        # ✅ Messages older than 5 minutes are dropped while recording
+        activity = chat_activity.record(chat_id, current_time)
+        chat_state.record_message(chat_id, current_time)
 
         # ✅ Check if dispute detection is active
-        if current_time - last_dispute_time > DISPUTE_TIMEOUT:
-            # ✅ Condition 1: At least 10 messages in the last 5 minutes
-            if len(recent_messages) >= MIN_MESSAGES:
+        if not chat_activity.cooling_down(activity, current_time):
+            # ✅ Condition 1: At least MIN_MESSAGES messages in the last 5 minutes
+            if chat_activity.is_busy(activity):
                 # ✅ Condition 2: Dispute-related phrases detected
-                if any(phrase in text.lower() for phrase in DISPUTE_PHRASES):
+                if DISPUTE in triggers:
                     try:
-                        await context.bot.send_message(chat_id=TARGET_GROUP_ID, text="👻 #срач")
-                        last_dispute_time = current_time  # Set cooldown
-                        logging.info("👻 #срач triggered in the group!")
+                        await context.bot.send_message(chat_id=chat_id, text="👻 #срач")
+                        activity.last_dispute_time = current_time  # Set cooldown
+                        chat_state.record_dispute(chat_id, current_time)
+                        logging.info(f"👻 #срач triggered in the group {chat_id}!")
                     except Exception as e:
                         logging.error(f"❌ Error posting #срач: {e}")
 
         # ✅ If any user manually posts #срач, disable detection for 1 hour
-        if "#срач" in text.lower():
-            last_dispute_time = current_time  # Reset cooldown
-            logging.info("Dispute detection disabled for 1 hour due to manual #срач.")
+        if MANUAL_DISPUTE in triggers:
+            activity.last_dispute_time = current_time  # Reset cooldown
+            chat_state.record_dispute(chat_id, current_time)
+            logging.info(f"Dispute detection disabled for 1 hour in {chat_id} due to manual #срач.")
 
     # ✅ Detect if the message contains "@all"
-    if "@all" in text.lower():
+    if TAG_ALL in triggers:
         await tag_all(update, context)  # Trigger the tagging function
 
     # ✅ Detect if the message is a poll
@@ -426,48 +612,92 @@ async def track_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🍄 #опитування", reply_to_message_id=update.message.message_id)
 
     # ✅ Detect specific keywords and send a random sticker
-    keywords = [
-        "зельда", "зельдос", "Зельда", "Зельдос",
-        "зельду", "зельдоса", "Зельду", "Зельдоса",
-        "зельдою", "зельдосом", "Зельдою", "Зельдосом"
-    ]
-
-    if any(word in text for word in keywords):
+    if ZELDA in triggers:
         guaranteed = "?" in text
 
         should_respond = guaranteed or random.randint(1, 100) <= RESPONSE_CHANCE_PERCENT
 
         if should_respond:
-            random_sticker = random.choice(ZELDA_FACE_STICKERS)
-            await update.message.reply_sticker(random_sticker, reply_to_message_id=update.message.message_id)
+            sticker = random.choice(ZELDA_FACE_STICKERS.assets)
+            # ✅ Random stickers are the first thing to skip when the chat is busy
+            rate_limit_args = None if guaranteed else LOW_PRIORITY
+            try:
+                await media_cache.send(
+                    lambda media: context.bot.send_sticker(
+                        chat_id=chat_id, sticker=media,
+                        reply_to_message_id=update.message.message_id, rate_limit_args=rate_limit_args,
+                    ),
+                    sticker.url, sticker.path, sticker_file_id, key=sticker.sha,
+                )
+            except SendDropped as e:
+                logging.info(f"🎲 {e}")
         else:
-            logging.info("🎲 Skipped sticker reply due to random chance.")
-
-
-def main():
-    print("⏳ Waiting 5 seconds before starting the bot...")
-    time.sleep(5)  # ⏱️ Delay startup
-    print("1")
-    """Start the bot"""
-    setup_database()  # Ensure database is set up on start
-    print("2")
-    # ✅ Use post_init to call notify_admin after bot is ready
-    app = Application.builder().token(TOKEN).post_init(notify_admin).build()
-    print("3")
+            logging.debug("🎲 Skipped sticker reply due to random chance.")
+
+
+def build_application(request=None):
+    """Creates the Application with all handlers; request replaces the HTTP layer (used by benchmarks)"""
+    # ✅ Use post_init to set up the database and call notify_admin after bot is ready
+    builder = (
+        Application.builder()
+        .application_class(BotApplication)
+        .token(TOKEN)
+        .concurrent_updates(update_processor)  # ✅ Chats are handled in parallel, each one in order
+        .rate_limiter(rate_limiter)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler(["tagall", "all"], tag_all))
     app.add_handler(CommandHandler("speak", speak))  # ✅ New CommandHandler for /speak
     app.add_handler(CommandHandler("spies", spies))
+    app.add_handler(CommandHandler("status", status))
+    app.add_handler(CommandHandler("stats", stats))
     app.add_handler(CommandHandler(["bridge_or_park", "park_or_bridge", "mist_chy_park", "park_chy_mist",
                                     "bridgeorpark", "parkorbridge", "mistchypark", "parkchymist"], bridge_or_park))
     app.add_handler(CommandHandler(["tea", "dzhokonda"], tea_command))
-    print("4")
     app.add_handler(CallbackQueryHandler(tea_callback, pattern=r"^tea_"))
-    print("5")
+    app.add_handler(InlineQueryHandler(tea_search))  # Needs inline mode enabled in @BotFather
     app.add_handler(MessageHandler(filters.ALL, track_users))  # Track users who send messages
 
-    print("Bot is running...")
-    app.run_polling()
+    # ✅ Latency/error histograms for every handler plus queue depths, see /metrics
+    metrics.instrument_handlers(app)
+    metrics.gauge("zelebot_update_queue_depth", app.update_queue.qsize, "Updates fetched but not dispatched")
+    metrics.gauge("zelebot_updates_waiting", lambda: update_processor.waiting, "Updates waiting for their chat or a slot")
+    metrics.gauge("zelebot_updates_in_flight", lambda: update_processor.in_flight, "Updates being handled")
+    metrics.gauge("zelebot_update_wait_seconds_max", lambda: update_processor.max_wait, "Longest wait before handling")
+    metrics.gauge("zelebot_user_writes_pending", lambda: user_writer.pending, "User upserts not yet flushed")
+    metrics.gauge("zelebot_activity_deltas_pending", lambda: activity_counters.pending, "Activity counters not yet saved")
+    metrics.gauge("zelebot_chat_state_pending", lambda: chat_state.pending, "Activity records not yet journaled")
+    metrics.gauge("zelebot_outbound_waiting", lambda: rate_limiter.waiting, "Bot API calls waiting for flood control")
+    metrics.gauge("zelebot_outbound_dropped_total", lambda: rate_limiter.dropped, "Low-priority sends skipped",
+                  kind="counter")
+    metrics.gauge("zelebot_outbound_flood_waits_total", lambda: rate_limiter.flood_waits, "RetryAfter responses",
+                  kind="counter")
+    return app
+
+
+def main():
+    """Start the bot"""
+    app = build_application()
+
+    if WEBHOOK_URL:
+        # ✅ Embedded HTTP server: answers 200 as soon as the update is queued, stops on SIGINT/SIGTERM
+        print(f"Bot is running (webhook on port {PORT})...")
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+    else:
+        print("Bot is running...")
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+import re
+
+# Trigger classes reported by TriggerMatcher.scan()
+DISPUTE = "dispute"
+ZELDA = "zelda"
+TAG_ALL = "tag_all"
+MANUAL_DISPUTE = "manual_dispute"
+
+# "зельд" covers every case/declension: зельда, зельду, зельдою, зельдос, зельдоса, ...
+ZELDA_STEMS = ("зельд",)
+
+
+class TriggerMatcher:
+    """Finds every trigger class of a message with one lower() and one regex pass.
+
+    All phrases are compiled into a single alternation of named groups, so
+    the text is scanned once no matter how many phrases there are. Classes
+    never overlap each other (no dispute phrase contains a Zelda stem, @all
+    or #срач), so non-overlapping matching can't hide a class.
+    """
+
+    def __init__(self, dispute_phrases, zelda_stems=ZELDA_STEMS):
+        groups = {
+            # Longest first so "не погоджуюсь" wins over a shorter phrase at the same position
+            DISPUTE: sorted({p.lower() for p in dispute_phrases}, key=len, reverse=True),
+            ZELDA: [s.lower() for s in zelda_stems],
+            TAG_ALL: ["@all"],
+            MANUAL_DISPUTE: ["#срач"],
+        }
+        self.classes = frozenset(groups)
+        self.pattern = re.compile("|".join(
+            f"(?P<{name}>{'|'.join(map(re.escape, phrases))})" for name, phrases in groups.items()
+        ))
+
+    def scan(self, text):
+        """Returns the set of trigger classes present in text"""
+        found = set()
+        if not text:
+            return found
+        for match in self.pattern.finditer(text.lower()):
+            found.add(match.lastgroup)
+            if len(found) == len(self.classes):
+                break
+        return found
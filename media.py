@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from telegram.error import BadRequest
+
+# What Telegram says about a file_id it doesn't accept (any more)
+FILE_ID_ERRORS = ("file identifier", "file_id", "file reference")
+
+
+def content_hash(path):
+    """Git blob SHA-1 of a file, the same value the GitHub contents API reports as "sha" """
+    with open(path, "rb") as f:
+        data = f.read()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def rejects_file_id(error):
+    """Whether a BadRequest is about the file_id itself (not e.g. a deleted chat or a bad caption)"""
+    message = error.message.lower()
+    return any(reason in message for reason in FILE_ID_ERRORS)
+
+
+class MediaCache:
+    """Remembers the Telegram file_id of every asset we have already sent.
+
+    Once Telegram has a copy of a card or sticker we send its file_id instead
+    of a URL, so their servers don't have to fetch it from GitHub again.
+    Entries are keyed by content hash and persisted to a small JSON file.
+    Writes are coalesced: while one is in flight, further changes only mark
+    the cache dirty and go out together in the next write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file_ids = {}
+        self._hashes = {}  # local path -> content hash
+        self._dirty = False
+        self._writing = False
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._file_ids = json.load(f)
+            logging.info(f"✅ Loaded {len(self._file_ids)} cached file_ids")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.error(f"❌ Failed to read media cache {path}: {e}")
+
+    def __len__(self):
+        return len(self._file_ids)
+
+    def key_for(self, url, local_path):
+        """Content hash of the local copy, or the URL if there isn't one"""
+        if local_path and os.path.isfile(local_path):
+            key = self._hashes.get(local_path)
+            if key is None:
+                key = self._hashes[local_path] = content_hash(local_path)
+            return key
+        return url
+
+    def get(self, key):
+        return self._file_ids.get(key)
+
+    def _save(self, snapshot):
+        directory, name = os.path.split(os.path.abspath(self.path))
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, prefix=name + ".",
+                                         suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            json.dump(snapshot, f)
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    async def _persist(self):
+        self._dirty = True
+        if self._writing:
+            return  # The write in flight goes round again and picks this change up
+        self._writing = True
+        try:
+            while self._dirty:
+                self._dirty = False
+                try:
+                    await asyncio.to_thread(self._save, dict(self._file_ids))
+                except OSError as e:
+                    logging.error(f"❌ Failed to write media cache {self.path}: {e}")
+        finally:
+            self._writing = False
+
+    async def put(self, key, file_id):
+        if self._file_ids.get(key) == file_id:
+            return
+        self._file_ids[key] = file_id
+        await self._persist()
+
+    async def forget(self, key):
+        if self._file_ids.pop(key, None) is not None:
+            await self._persist()
+
+    async def send(self, send, url, local_path, file_id_of, key=None, data=None):
+        """Sends an asset through send(media), preferring a cached file_id.
+
+        A rejected file_id (e.g. after the bot token changed) is dropped and
+        the local file is uploaded instead; the URL is only used when there
+        is no local copy. data, if given, is uploaded instead of the local
+        file (e.g. an optimized variant). key defaults to the hash of the
+        local file.
+        """
+        key = key or self.key_for(url, local_path)
+        file_id = self.get(key)
+        if file_id:
+            try:
+                return await send(file_id)
+            except BadRequest as e:
+                if not rejects_file_id(e):
+                    raise
+                logging.warning(f"⚠️ Cached file_id for {url} was rejected, uploading again: {e}")
+                await self.forget(key)
+
+        if data is not None:
+            message = await send(bytes(data))
+        elif local_path and os.path.isfile(local_path):
+            with open(local_path, "rb") as f:
+                message = await send(f)
+        else:
+            message = await send(url)
+
+        await self.put(key, file_id_of(message))
+        return message
+
+
+def photo_file_id(message):
+    return message.photo[-1].file_id  # Largest size
+
+
+def sticker_file_id(message):
+    return message.sticker.file_id
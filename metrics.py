@@ -0,0 +1,179 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+# Seconds; covers everything from an in-memory handler to a slow upload
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class Metrics:
+    """In-process counters and latency histograms, rendered in Prometheus text format.
+
+    Everything is updated from the event loop thread, so plain dicts are
+    enough. Gauges are callables evaluated when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self.histograms = {}  # (metric name, label value) -> Histogram
+        self.counters = {}  # (metric name, label value) -> int
+        self.gauges = {}  # metric name -> (callable, type)
+        self._label_names = {}  # metric name -> label name
+        self._help = {}
+
+    def observe(self, name, label_name, label, seconds, help_text=""):
+        histogram = self.histograms.get((name, label))
+        if histogram is None:
+            histogram = self.histograms[(name, label)] = Histogram()
+            self._label_names[name] = label_name
+            self._help.setdefault(name, help_text)
+        histogram.observe(seconds)
+
+    def increment(self, name, label_name, label, help_text=""):
+        self.counters[(name, label)] = self.counters.get((name, label), 0) + 1
+        self._label_names[name] = label_name
+        self._help.setdefault(name, help_text)
+
+    def gauge(self, name, read, help_text="", kind="gauge"):
+        """Reports read() on every scrape; kind="counter" for values that only grow"""
+        self.gauges[name] = (read, kind)
+        self._help[name] = help_text
+
+    def instrument(self, name, callback):
+        """Wraps a handler callback to record its latency and errors"""
+        @functools.wraps(callback)
+        async def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.increment("zelebot_handler_errors_total", "handler", name, "Exceptions raised by handlers")
+                raise
+            finally:
+                self.observe("zelebot_handler_seconds", "handler", name, time.perf_counter() - started,
+                             "Handler latency")
+        return timed
+
+    def instrument_handlers(self, app):
+        for handlers in app.handlers.values():
+            for handler in handlers:
+                handler.callback = self.instrument(handler.callback.__name__, handler.callback)
+
+    def observe_api(self, endpoint, seconds, failed):
+        self.observe("zelebot_api_seconds", "endpoint", endpoint, seconds, "Bot API call latency")
+        if failed:
+            self.increment("zelebot_api_errors_total", "endpoint", endpoint, "Failed Bot API calls")
+
+    def render(self):
+        lines = []
+        by_name = {}
+        for (name, label), histogram in sorted(self.histograms.items()):
+            by_name.setdefault(name, []).append((label, histogram))
+        for name, series in by_name.items():
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} histogram")
+            label_name = self._label_names[name]
+            for label, histogram in series:
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(**{label_name: label, 'le': bound})} {cumulative}")
+                lines.append(f"{name}_sum{_labels(**{label_name: label})} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(**{label_name: label})} {histogram.count}")
+
+        seen = set()
+        for (name, label), value in sorted(self.counters.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_labels(**{self._label_names[name]: label})} {value}")
+
+        for name, (read, kind) in sorted(self.gauges.items()):
+            try:
+                value = read()
+            except Exception as e:
+                logging.debug("Gauge %s failed: %s", name, e)
+                continue
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class TimedStorage:
+    """Wraps a storage backend and records how long every database call takes"""
+
+    def __init__(self, storage, metrics):
+        self._storage = storage
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await attribute(*args, **kwargs)
+            except Exception:
+                self._metrics.increment("zelebot_db_errors_total", "operation", name, "Failed database calls")
+                raise
+            finally:
+                self._metrics.observe("zelebot_db_seconds", "operation", name, time.perf_counter() - started,
+                                      "Database call latency")
+        return timed
+
+
+async def start_metrics_server(metrics, host, port):
+    """Serves GET /metrics over plain HTTP; returns the asyncio server"""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logging.info(f"📈 Metrics available on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter
+
+# Priorities, passed to any bot method as rate_limit_args={"priority": ...}
+HIGH = 0  # Admin /speak, @all mentions: waits as long as needed and retries until delivered
+NORMAL = 1  # Regular replies: waits for its turn, retries once after a flood wait
+LOW = 2  # Random stickers: dropped instead of queued when the chat or the bot is busy
+
+HIGH_PRIORITY = {"priority": HIGH}
+LOW_PRIORITY = {"priority": LOW}
+
+
+class SendDropped(TelegramError):
+    """A low-priority request was skipped to stay under Telegram's flood limits"""
+
+
+class _Bucket:
+    """Token bucket kept as a theoretical arrival time (GCRA), so waiting costs no task"""
+
+    __slots__ = ("interval", "tolerance", "tat")
+
+    def __init__(self, rate, burst):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0
+
+    def delay(self, now):
+        return max(0.0, max(self.tat, now) - self.tolerance - now)
+
+    def take(self, now):
+        self.tat = max(self.tat, now) + self.interval
+
+    def block(self, now, seconds):
+        """Nothing may pass before now + seconds"""
+        self.tat = max(self.tat, now + seconds + self.tolerance)
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """Keeps outgoing Bot API calls under the global and per-chat limits.
+
+    Telegram allows about 30 messages per second overall, 1 per second in a
+    private chat and 20 per minute in a group. Each request reserves a slot
+    in the global bucket and its chat's bucket and sleeps until both are
+    free. A RetryAfter from Telegram blocks the chat's bucket (or the global
+    one for requests without a chat) for the requested time, so everything
+    else queued for it waits too.
+    """
+
+    def __init__(self, overall_per_second=30, private_per_second=1, group_per_minute=20,
+                 low_priority_max_wait=1.0, high_priority_retries=10, max_chats=1000, observe=None):
+        self._overall = _Bucket(overall_per_second, overall_per_second)
+        self.private_per_second = private_per_second
+        self.group_per_minute = group_per_minute
+        self.low_priority_max_wait = low_priority_max_wait
+        self.high_priority_retries = high_priority_retries
+        self.max_chats = max_chats
+        self.observe = observe  # observe(endpoint, seconds, failed) after every call
+        self._chats = {}
+        self.sent = 0
+        self.dropped = 0
+        self.flood_waits = 0
+        self.waiting = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        return {"sent": self.sent, "dropped": self.dropped, "flood_waits": self.flood_waits, "waiting": self.waiting}
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # Forget chats whose bucket is completely refilled
+                self._chats = {cid: b for cid, b in self._chats.items() if b.tat > now}
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = _Bucket(self.private_per_second, 1)
+            else:
+                bucket = _Bucket(self.group_per_minute / 60, self.group_per_minute)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_slot(self, chat_id, priority):
+        now = time.monotonic()
+        buckets = [self._overall]
+        if chat_id is not None:
+            buckets.append(self._chat_bucket(chat_id, now))
+        delay = max(bucket.delay(now) for bucket in buckets)
+        if priority >= LOW and delay > self.low_priority_max_wait:
+            self.dropped += 1
+            raise SendDropped(f"Skipped low-priority request to {chat_id}, next slot in {delay:.1f}s")
+        for bucket in buckets:
+            bucket.take(now)
+        if delay:
+            self.waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.waiting -= 1
+        return buckets
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get("priority", NORMAL)
+        chat_id = data.get("chat_id")
+        attempts = 0
+        while True:
+            buckets = await self._wait_for_slot(chat_id, priority)
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = await callback(*args, **kwargs)
+                failed = False
+                self.sent += 1
+                return result
+            except RetryAfter as e:
+                self.flood_waits += 1
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                buckets[-1].block(time.monotonic(), retry_after)
+                attempts += 1
+                if priority >= LOW or (priority == NORMAL and attempts > 1) or attempts > self.high_priority_retries:
+                    raise
+                logging.warning(f"⏳ Flood control on {endpoint} to {chat_id}, retrying in {retry_after}s")
+            finally:
+                if self.observe:
+                    self.observe(endpoint, time.perf_counter() - started, failed)
@@ -0,0 +1,41 @@
+import asyncio
+
+
+class PeriodicFlush:
+    """Calls flush() every interval seconds in a background task.
+
+    wake() runs it sooner. stop() lets a flush that is already running
+    finish instead of cancelling it halfway through a write; the owner does
+    its own final write afterwards.
+    """
+
+    def __init__(self, flush, interval):
+        self.flush = flush
+        self.interval = interval
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
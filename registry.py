@@ -0,0 +1,127 @@
+import html
+
+
+class UserRegistry:
+    """Process-local copy of the users and chat_members tables.
+
+    Warmed from the database at startup and kept up to date by track_users.
+    observe(), join() and leave() tell the caller whether anything actually
+    changed, so only real changes are written back. Mentions are rendered
+    (and HTML-escaped) once per user, and the mention list of a chat is
+    rebuilt only after its members or their names changed.
+    """
+
+    def __init__(self):
+        self._users = {}  # user_id -> (username, first_name)
+        self._mentions = {}  # user_id -> rendered mention
+        self._members = {}  # chat_id -> {user_id: None}, in the order they were seen
+        self._chat_mentions = {}  # chat_id -> ((user_id, rendered mention), ...), dropped when stale
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def load(self, rows):
+        """Fills the registry from (user_id, username, first_name) rows.
+
+        Users observed before the load finished keep their fresher identity.
+        """
+        for user_id, username, first_name in rows:
+            self._users.setdefault(user_id, (username, first_name))
+        self._mentions.clear()
+        self._chat_mentions.clear()
+
+    def load_members(self, rows):
+        """Fills chat membership from (chat_id, user_id) rows"""
+        for chat_id, user_id in rows:
+            self._members.setdefault(chat_id, {})[user_id] = None
+        self._chat_mentions.clear()
+
+    def observe(self, user_id, username, first_name):
+        """Records a user and returns True if they are new or changed their name"""
+        identity = (username, first_name)
+        if self._users.get(user_id) == identity:
+            return False
+        self._users[user_id] = identity
+        if self._mentions.pop(user_id, None) is not None:
+            self._chat_mentions.clear()  # Rare: somebody known changed their name
+        return True
+
+    def join(self, chat_id, user_id):
+        """Records that the user is in the chat; True if that is news"""
+        members = self._members.setdefault(chat_id, {})
+        if user_id in members:
+            return False
+        members[user_id] = None
+        self._chat_mentions.pop(chat_id, None)
+        return True
+
+    def leave(self, chat_id, user_id):
+        """Forgets the user's membership in the chat; True if they were a member"""
+        members = self._members.get(chat_id)
+        if not members or user_id not in members:
+            return False
+        del members[user_id]
+        self._chat_mentions.pop(chat_id, None)
+        return True
+
+    def member_count(self, chat_id):
+        return len(self._members.get(chat_id, ()))
+
+    def mention(self, user_id):
+        rendered = self._mentions.get(user_id)
+        if rendered is None:
+            username, first_name = self._users.get(user_id, (None, None))
+            rendered = render_mention(user_id, username, first_name)
+            self._mentions[user_id] = rendered
+        return rendered
+
+    def display_name(self, user_id):
+        """A name to show without pinging the user"""
+        username, first_name = self._users.get(user_id, (None, None))
+        for name in (first_name, username):
+            if name and name != "None":
+                return name
+        return f"user {user_id}"
+
+    def _chat_mention_list(self, chat_id):
+        mentions = self._chat_mentions.get(chat_id)
+        if mentions is None:
+            mentions = tuple((user_id, self.mention(user_id)) for user_id in self._members.get(chat_id, ()))
+            self._chat_mentions[chat_id] = mentions
+        return mentions
+
+    def mention_chunks(self, chat_id, sender_id, prefix="", max_chars=4096, max_mentions=50):
+        """Mentions of the chat's members except sender_id, packed into messages.
+
+        Every message is prefix plus comma-separated mentions, at most
+        max_chars long and with at most max_mentions mentions.
+        """
+        chunks = []
+        parts = []
+        length = len(prefix)
+        for user_id, rendered in self._chat_mention_list(chat_id):
+            if user_id == sender_id:
+                continue
+            added = len(rendered) + (2 if parts else 0)  # ", "
+            if parts and (len(parts) >= max_mentions or length + added > max_chars):
+                chunks.append(prefix + ", ".join(parts))
+                parts = []
+                length = len(prefix)
+                added = len(rendered)
+            parts.append(rendered)
+            length += added
+        if parts:
+            chunks.append(prefix + ", ".join(parts))
+        return chunks
+
+
+def render_mention(user_id, username, first_name):
+    """@username when possible, otherwise a tg://user?id=... link (HTML)"""
+    # Older rows store the string "None" for missing values
+    if username and username != "None":
+        return f"@{username}"
+    safe_name = html.escape(first_name) if first_name and first_name != "None" else "user"
+    return f'<a href="tg://user?id={user_id}">{safe_name}</a>'
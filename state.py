@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import os
+import struct
+
+from periodic import PeriodicFlush
+
+# Snapshot: header, then per chat (chat_id, last_dispute_time, count) followed by count timestamps
+SNAPSHOT_HEADER = struct.Struct("<4sHII")  # magic, version, generation, chats
+SNAPSHOT_CHAT = struct.Struct("<qdH")
+TIMESTAMP = struct.Struct("<d")
+# Journal: header, then fixed-size records appended between snapshots
+JOURNAL_HEADER = struct.Struct("<4sHI")  # magic, version, generation
+JOURNAL_RECORD = struct.Struct("<Bqd")  # kind, chat_id, time
+
+SNAPSHOT_MAGIC = b"ZSNP"
+JOURNAL_MAGIC = b"ZJRN"
+VERSION = 1
+
+MESSAGE = 1
+DISPUTE = 2
+
+
+class ChatStateStore:
+    """Keeps the per-chat activity windows and #срач cooldowns across restarts.
+
+    track_users only appends a 17-byte record to an in-memory buffer; a
+    background task appends the buffer to the journal every flush_interval
+    seconds. Once the journal grows past max_journal_bytes (and on shutdown)
+    the whole tracker is written as a snapshot and the journal starts over.
+
+    Snapshot and journal carry a generation number. A journal is replayed
+    only on top of the snapshot of the same generation, so a crash between
+    writing a snapshot and resetting the journal never counts a message
+    twice. A torn record at the end of the journal is cut off on restore, so
+    new records stay aligned.
+    """
+
+    def __init__(self, path, tracker, flush_interval=1.0, max_journal_bytes=256 * 1024):
+        self.snapshot_path = f"{path}.bin"
+        self.journal_path = f"{path}.journal"
+        self.tracker = tracker
+        self.flush_interval = flush_interval
+        self.max_journal_bytes = max_journal_bytes
+        self._generation = 0
+        self._journal_bytes = 0
+        self._buffer = bytearray()
+        self._timer = PeriodicFlush(self.flush, flush_interval)
+
+    @property
+    def pending(self):
+        return len(self._buffer) // JOURNAL_RECORD.size
+
+    def record_message(self, chat_id, now):
+        self._buffer += JOURNAL_RECORD.pack(MESSAGE, chat_id, now)
+
+    def record_dispute(self, chat_id, now):
+        self._buffer += JOURNAL_RECORD.pack(DISPUTE, chat_id, now)
+
+    # Reading
+
+    def _read(self):
+        snapshot = b""
+        journal = b""
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = f.read()
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.journal_path, "rb") as f:
+                journal = f.read()
+        except FileNotFoundError:
+            pass
+        return snapshot, journal
+
+    def _restore_snapshot(self, data):
+        if len(data) < SNAPSHOT_HEADER.size:
+            return 0
+        magic, version, generation, chats = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != VERSION:
+            raise ValueError("not a chat state snapshot")
+        offset = SNAPSHOT_HEADER.size
+        for _ in range(chats):
+            chat_id, last_dispute_time, count = SNAPSHOT_CHAT.unpack_from(data, offset)
+            offset += SNAPSHOT_CHAT.size
+            activity = self.tracker.get(chat_id)
+            activity.timestamps.extend(struct.unpack_from(f"<{count}d", data, offset))
+            activity.last_dispute_time = last_dispute_time
+            offset += count * TIMESTAMP.size
+        self._generation = generation
+        return chats
+
+    def _replay_journal(self, data):
+        """Applies the journal to the tracker; None when it doesn't belong to the snapshot"""
+        if len(data) < JOURNAL_HEADER.size:
+            return None
+        magic, version, generation = JOURNAL_HEADER.unpack_from(data)
+        if magic != JOURNAL_MAGIC or version != VERSION or generation != self._generation:
+            return None  # Missing, or already contained in the snapshot
+        body = memoryview(data)[JOURNAL_HEADER.size:]
+        body = body[:len(body) - len(body) % JOURNAL_RECORD.size]  # Drop a torn last record
+        for kind, chat_id, when in JOURNAL_RECORD.iter_unpack(body):
+            if kind == MESSAGE:
+                self.tracker.record(chat_id, when)
+            elif kind == DISPUTE:
+                self.tracker.get(chat_id).last_dispute_time = when
+        self._journal_bytes = JOURNAL_HEADER.size + len(body)
+        return len(body) // JOURNAL_RECORD.size
+
+    async def restore(self):
+        """Loads the last snapshot and replays the journal into the tracker"""
+        snapshot, journal = await asyncio.to_thread(self._read)
+        try:
+            chats = self._restore_snapshot(snapshot)
+            records = self._replay_journal(journal)
+        except (ValueError, struct.error) as e:
+            logging.error(f"❌ Chat state is unreadable, the rest of it is skipped: {e}")
+            chats, records = 0, None
+        if records is None:
+            # Appends must go to a journal of the current generation
+            try:
+                await asyncio.to_thread(self._reset_journal, self._generation)
+            except OSError as e:
+                logging.error(f"❌ Failed to save chat state: {e}")
+            records = 0
+        elif len(journal) != self._journal_bytes:
+            # Appending after a torn record would shift every later record
+            try:
+                await asyncio.to_thread(os.truncate, self.journal_path, self._journal_bytes)
+            except OSError as e:
+                logging.error(f"❌ Failed to save chat state: {e}")
+        if chats or records:
+            logging.info(f"✅ Restored activity of {len(self.tracker)} chat(s) "
+                         f"({chats} from the snapshot, {records} journal records)")
+
+    # Writing
+
+    def _encode_snapshot(self, generation):
+        chats = list(self.tracker.items())
+        parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, VERSION, generation, len(chats))]
+        for chat_id, activity in chats:
+            timestamps = activity.timestamps
+            parts.append(SNAPSHOT_CHAT.pack(chat_id, activity.last_dispute_time, len(timestamps)))
+            parts.append(struct.pack(f"<{len(timestamps)}d", *timestamps))
+        return b"".join(parts)
+
+    def _write_snapshot(self, data, generation):
+        temporary = self.snapshot_path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        self._reset_journal(generation)
+
+    def _reset_journal(self, generation):
+        with open(self.journal_path, "wb") as f:
+            f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, VERSION, generation))
+        self._journal_bytes = JOURNAL_HEADER.size
+
+    def _append(self, chunk):
+        with open(self.journal_path, "ab") as f:
+            f.write(chunk)
+            return f.tell()
+
+    async def snapshot(self):
+        """Writes the whole tracker and starts a new, empty journal"""
+        generation = self._generation + 1
+        data = self._encode_snapshot(generation)
+        self._buffer.clear()  # Everything buffered so far is part of data
+        await asyncio.to_thread(self._write_snapshot, data, generation)
+        self._generation = generation
+
+    async def flush(self):
+        try:
+            if self._journal_bytes >= self.max_journal_bytes:
+                await self.snapshot()
+                return
+            if not self._buffer:
+                return
+            chunk = bytes(self._buffer)
+            self._buffer.clear()
+            try:
+                self._journal_bytes = await asyncio.to_thread(self._append, chunk)
+            except OSError:
+                self._buffer[:0] = chunk  # Retried with the next flush
+                raise
+        except OSError as e:
+            logging.error(f"❌ Failed to save chat state: {e}")
+
+    def start(self):
+        self._timer.start()
+
+    async def stop(self):
+        """Stops the timer and leaves a fresh snapshot behind"""
+        await self._timer.stop()
+        try:
+            await self.snapshot()
+        except OSError as e:
+            logging.error(f"❌ Failed to save chat state: {e}")
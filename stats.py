@@ -0,0 +1,113 @@
+import heapq
+import logging
+
+from db import DATABASE_ERRORS
+from periodic import PeriodicFlush
+
+
+class Leaderboard:
+    """The top users of one chat, most active first.
+
+    Counts only grow, so a user outside the board can get in only by passing
+    the last entry; an update is O(size) and never sorts the whole chat.
+    """
+
+    __slots__ = ("size", "users")
+
+    def __init__(self, size):
+        self.size = size
+        self.users = []
+
+    def rebuild(self, counts):
+        self.users = heapq.nlargest(self.size, counts, key=counts.__getitem__)
+
+    def update(self, user_id, counts):
+        users = self.users
+        count = counts[user_id]
+        if user_id in users:
+            position = users.index(user_id)
+        elif len(users) < self.size:
+            users.append(user_id)
+            position = len(users) - 1
+        elif count > counts[users[-1]]:
+            users[-1] = user_id
+            position = len(users) - 1
+        else:
+            return
+        while position > 0 and counts[users[position - 1]] < count:
+            users[position - 1], users[position] = users[position], users[position - 1]
+            position -= 1
+
+
+class ActivityCounters:
+    """Messages per user per chat, counted in memory and saved as deltas.
+
+    Every message bumps a counter and the chat's leaderboard; every
+    flush_interval seconds the deltas collected since the last flush are
+    added to the user_activity table in one statement.
+    """
+
+    def __init__(self, storage, flush_interval=10.0, top_size=10):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.top_size = top_size
+        self._counts = {}  # chat_id -> {user_id: messages}
+        self._boards = {}  # chat_id -> Leaderboard
+        self._deltas = {}  # (chat_id, user_id) -> messages not yet saved
+        self._timer = PeriodicFlush(self.flush, flush_interval)
+
+    @property
+    def pending(self):
+        return len(self._deltas)
+
+    def _board(self, chat_id):
+        board = self._boards.get(chat_id)
+        if board is None:
+            board = self._boards[chat_id] = Leaderboard(self.top_size)
+        return board
+
+    def load(self, rows):
+        """Adds saved (chat_id, user_id, messages) rows to whatever was counted meanwhile"""
+        for chat_id, user_id, messages in rows:
+            counts = self._counts.setdefault(chat_id, {})
+            counts[user_id] = counts.get(user_id, 0) + messages
+        for chat_id, counts in self._counts.items():
+            self._board(chat_id).rebuild(counts)
+
+    def increment(self, chat_id, user_id):
+        counts = self._counts.get(chat_id)
+        if counts is None:
+            counts = self._counts[chat_id] = {}
+        counts[user_id] = counts.get(user_id, 0) + 1
+        key = (chat_id, user_id)
+        self._deltas[key] = self._deltas.get(key, 0) + 1
+        self._board(chat_id).update(user_id, counts)
+
+    def top(self, chat_id, limit=None):
+        """[(user_id, messages), ...] of the most active users in the chat"""
+        board = self._boards.get(chat_id)
+        if board is None:
+            return []
+        counts = self._counts[chat_id]
+        return [(user_id, counts[user_id]) for user_id in board.users[:limit]]
+
+    async def flush(self):
+        if not self._deltas:
+            return
+        batch, self._deltas = self._deltas, {}
+        try:
+            await self.storage.add_user_activity([(*key, messages) for key, messages in batch.items()])
+        except (*DATABASE_ERRORS, RuntimeError) as e:
+            # Deltas add up, so merge the batch back with whatever was counted meanwhile.
+            # Not on cancellation: the worker thread may still commit it, and counting twice is worse.
+            for key, messages in batch.items():
+                self._deltas[key] = self._deltas.get(key, 0) + messages
+            logging.error(f"❌ Database error: {e}")
+
+    def start(self):
+        self._timer.start()
+
+    async def stop(self):
+        """Stops the timer and writes out the deltas counted since the last flush"""
+        await self._timer.stop()
+        await self.flush()
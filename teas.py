@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter, namedtuple
+
+RANDOM_CATEGORY = "Випадковий"
+RANDOM_EMOJI = "🎲"
+DEFAULT_EMOJI = "🍵"  # Sections added to the menu later
+CATEGORY_EMOJI = {
+    "Чорні": "🍂",
+    "Зелені": "🍃",
+    "Травʼяні": "🌱",
+    "Пуери": "🕰",
+    "Фруктові": "🫐",
+    "Особливі": "🌸",
+    "Літні": "🌞",
+}
+NOT_FOUND = "🎲❌🫖 няв😿"
+
+SECTION = re.compile(r"^-{3,}\s*(.+?)\s*-{3,}$")
+WORD = re.compile(r"\w+")
+
+Tea = namedtuple("Tea", ["name", "category", "description", "emoji"])
+
+
+def parse_menu(text):
+    """Reads "----- Category -----" sections of name/description line pairs"""
+    teas = []
+    category = None
+    lines = iter(line.strip() for line in text.splitlines())
+    for line in lines:
+        if not line:
+            continue
+        section = SECTION.match(line)
+        if section:
+            category = section.group(1)
+            continue
+        if category is None:
+            raise ValueError(f"tea {line!r} is outside of any section")
+        description = next(lines, "")
+        teas.append(Tea(line, category, description, CATEGORY_EMOJI.get(category, DEFAULT_EMOJI)))
+    return teas
+
+
+def _normalize(text):
+    # People type the Ukrainian apostrophe (ʼ) in several ways
+    return text.casefold().replace("ʼ", "").replace("'", "").replace("’", "")
+
+
+def _words(text):
+    return WORD.findall(_normalize(text))
+
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TeaIndex:
+    """Immutable snapshot of the menu with every lookup precomputed.
+
+    Messages for each category (and for a random pick) are rendered once, so
+    a button press is one random.choice. Search goes through a word-prefix
+    index first and falls back to trigram overlap for typos.
+    """
+
+    def __init__(self, teas):
+        self.teas = tuple(teas)
+        self.categories = tuple(dict.fromkeys(tea.category for tea in self.teas))
+
+        messages = {category: [] for category in self.categories}
+        for tea in self.teas:
+            messages[tea.category].append(f"🎲{tea.emoji}🫖 {tea.name}\n\n{tea.description}")
+        self.messages = {category: tuple(texts) for category, texts in messages.items()}
+        self.messages[RANDOM_CATEGORY] = tuple(
+            f"{RANDOM_EMOJI}{RANDOM_EMOJI}🫖 {tea.name}\n\n{tea.description}" for tea in self.teas
+        )
+
+        prefixes = {}
+        trigrams = {}
+        for position, tea in enumerate(self.teas):
+            for word in _words(f"{tea.name} {tea.category}"):
+                for end in range(1, len(word) + 1):
+                    prefixes.setdefault(word[:end], set()).add(position)
+            for gram in _trigrams(" ".join(_words(tea.name))):
+                trigrams.setdefault(gram, set()).add(position)
+        self._prefixes = {key: frozenset(value) for key, value in prefixes.items()}
+        self._trigrams = {key: frozenset(value) for key, value in trigrams.items()}
+
+    def __len__(self):
+        return len(self.teas)
+
+    def pick(self, category):
+        """A rendered message for a random tea of the category, None if there is none"""
+        texts = self.messages.get(category)
+        return random.choice(texts) if texts else None
+
+    def search(self, query, limit=20):
+        """Teas whose name words start with every query word, else the closest names by trigrams"""
+        words = _words(query)
+        if not words:
+            return self.teas[:limit]
+
+        hits = None
+        for word in words:
+            matches = self._prefixes.get(word, frozenset())
+            hits = matches if hits is None else hits & matches
+            if not hits:
+                break
+        if hits:
+            return [self.teas[position] for position in sorted(hits)[:limit]]
+
+        grams = _trigrams(" ".join(words))
+        scores = Counter()
+        for gram in grams:
+            scores.update(self._trigrams.get(gram, ()))
+        needed = max(2, len(grams) // 2)
+        ranked = sorted((position for position, score in scores.items() if score >= needed),
+                        key=lambda position: (-scores[position], position))
+        return [self.teas[position] for position in ranked[:limit]]
+
+
+class TeaCatalog:
+    """The menu from dzhokonda.txt, reloaded when the file changes.
+
+    The file's mtime is checked at most once per check_interval seconds; a
+    reload builds a new TeaIndex off the event loop and swaps it in whole.
+    A broken edit keeps the previous menu.
+    """
+
+    def __init__(self, path, check_interval=5.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.index = TeaIndex(())
+        self._mtime = None
+        self._broken_mtime = None  # A bad edit is reported once, not on every check
+        self._checked_at = float("-inf")
+        self._lock = asyncio.Lock()
+
+    def _load_if_changed(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime in (self._mtime, self._broken_mtime):
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                index = TeaIndex(parse_menu(f.read()))
+        except ValueError:
+            self._broken_mtime = mtime
+            raise
+        return mtime, index
+
+    async def refresh(self):
+        """Reloads the menu if the file changed since the last check"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self.index
+        async with self._lock:
+            if now - self._checked_at < self.check_interval:  # Somebody else just checked
+                return self.index
+            self._checked_at = now
+            try:
+                loaded = await asyncio.to_thread(self._load_if_changed)
+            except (OSError, ValueError) as e:
+                logging.error(f"❌ Failed to load the tea menu from {self.path}: {e}")
+                return self.index
+            if loaded is not None:
+                reloaded = self._mtime is not None
+                self._mtime, self.index = loaded
+                if reloaded:
+                    logging.info(f"🍵 Tea menu reloaded: {len(self.index)} teas")
+        return self.index
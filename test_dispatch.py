@@ -0,0 +1,80 @@
+import asyncio
+import datetime
+import random
+import unittest
+
+from telegram import Chat, Message, Update, User
+
+from dispatch import PerChatUpdateProcessor
+
+CHATS = [-1001, -1002, -1003, 42]
+SENDER = User(1, "Зельда", False)
+
+
+def message_update(update_id, chat_id):
+    chat = Chat(chat_id, Chat.PRIVATE if chat_id > 0 else Chat.GROUP)
+    return Update(update_id, message=Message(update_id, datetime.datetime.now(), chat, from_user=SENDER))
+
+
+class PerChatUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.random = random.Random(17)
+        self.processor = PerChatUpdateProcessor(max_concurrent_updates=3)
+        self.started = []  # update_ids in the order their handlers started
+        self.handled = {}  # chat_id -> update_ids in the order their handlers started
+        self.running = {}  # chat_id -> handlers running right now
+        self.in_flight = 0
+        self.peak = 0
+
+    async def handle(self, update):
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        self.started.append(update.update_id)
+        self.handled.setdefault(chat_id, []).append(update.update_id)
+        self.running[chat_id] = self.running.get(chat_id, 0) + 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        if chat_id is not None:
+            self.assertEqual(self.running[chat_id], 1, f"two updates of chat {chat_id} ran at once")
+        try:
+            await asyncio.sleep(self.random.uniform(0, 0.005))
+        finally:
+            self.running[chat_id] -= 1
+            self.in_flight -= 1
+
+    async def push(self, updates):
+        # Like the Application: one task per update, started in arrival order
+        await asyncio.gather(*(
+            asyncio.create_task(self.processor.process_update(update, self.handle(update))) for update in updates
+        ))
+
+    async def test_keeps_order_per_chat_and_the_concurrency_cap(self):
+        updates = []
+        for update_id in range(300):
+            if update_id % 10 == 9:
+                updates.append(Update(update_id))  # No chat, e.g. an inline query
+            else:
+                updates.append(message_update(update_id, self.random.choice(CHATS)))
+        await self.push(updates)
+
+        for chat_id in CHATS:
+            expected = [update.update_id for update in updates
+                        if update.effective_chat and update.effective_chat.id == chat_id]
+            self.assertEqual(self.handled[chat_id], expected)
+        self.assertEqual(len(self.handled[None]), 30)
+        self.assertLessEqual(self.peak, self.processor.concurrency_limit)
+        self.assertGreater(self.peak, 1)  # Different chats did run concurrently
+
+        self.assertEqual(self.processor._chat_locks, {})
+        self.assertEqual(self.processor._chat_waiters, {})
+        self.assertEqual((self.processor.in_flight, self.processor.waiting, self.processor.processed), (0, 0, 300))
+
+    async def test_busy_chat_does_not_hold_up_the_others(self):
+        updates = [message_update(update_id, CHATS[0]) for update_id in range(20)]
+        updates.append(message_update(20, CHATS[1]))
+        await self.push(updates)
+        # The other chat's update took a free slot instead of queueing behind the whole backlog
+        self.assertLess(self.started.index(20), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
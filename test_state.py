@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+
+from activity import ActivityTracker
+from state import ChatStateStore, JOURNAL_HEADER, JOURNAL_MAGIC, JOURNAL_RECORD, MESSAGE, VERSION
+
+NOW = 1_760_000_000.0
+
+
+def snapshot_of(tracker):
+    return {chat_id: (list(activity.timestamps), activity.last_dispute_time) for chat_id, activity in tracker.items()}
+
+
+class ChatStateStoreTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "chat_state")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_store(self, **kwargs):
+        tracker = ActivityTracker(window=300, min_messages=20, dispute_timeout=3600)
+        return tracker, ChatStateStore(self.path, tracker, **kwargs)
+
+    def record(self, tracker, store, chat_id, when):
+        tracker.record(chat_id, when)
+        store.record_message(chat_id, when)
+
+    async def test_restores_journal_after_a_crash(self):
+        tracker, store = self.open_store()
+        await store.restore()
+        for n in range(30):
+            self.record(tracker, store, -(n % 3), NOW + n)
+        tracker.get(-1).last_dispute_time = NOW + 5
+        store.record_dispute(-1, NOW + 5)
+        await store.flush()  # No stop(): the process dies here
+
+        restored, store = self.open_store()
+        await store.restore()
+        self.assertEqual(snapshot_of(restored), snapshot_of(tracker))
+
+    async def test_stop_leaves_a_snapshot_and_an_empty_journal(self):
+        tracker, store = self.open_store(flush_interval=0.01)
+        await store.restore()
+        store.start()
+        for n in range(10):
+            self.record(tracker, store, -1, NOW + n)
+        await store.stop()
+        self.assertEqual(os.path.getsize(store.journal_path), JOURNAL_HEADER.size)
+
+        restored, store = self.open_store()
+        await store.restore()
+        self.assertEqual(snapshot_of(restored), snapshot_of(tracker))
+
+    async def test_torn_record_is_cut_off_before_appending(self):
+        tracker, store = self.open_store()
+        await store.restore()
+        self.record(tracker, store, -1, NOW)
+        await store.flush()
+        with open(store.journal_path, "ab") as f:
+            f.write(b"\x01\x02\x03\x04\x05")  # Half-written record
+
+        tracker, store = self.open_store()
+        await store.restore()
+        for n in range(1, 4):
+            self.record(tracker, store, -1, NOW + n)
+        await store.flush()
+
+        restored, store = self.open_store()
+        await store.restore()
+        self.assertEqual(snapshot_of(restored), {-1: ([NOW, NOW + 1, NOW + 2, NOW + 3], 0)})
+
+    async def test_compaction_keeps_every_message(self):
+        tracker, store = self.open_store(max_journal_bytes=JOURNAL_HEADER.size + 10 * JOURNAL_RECORD.size)
+        await store.restore()
+        for n in range(100):
+            self.record(tracker, store, -(n % 7), NOW + n)
+            await store.flush()
+        self.assertGreater(store._generation, 0)
+        self.assertLess(os.path.getsize(store.journal_path), store.max_journal_bytes + JOURNAL_RECORD.size)
+
+        restored, store = self.open_store()
+        await store.restore()
+        self.assertEqual(snapshot_of(restored), snapshot_of(tracker))
+
+    async def test_journal_of_an_older_generation_is_ignored(self):
+        tracker, store = self.open_store()
+        await store.restore()
+        self.record(tracker, store, -1, NOW)
+        await store.stop()
+        # Crash between writing the snapshot and resetting the journal
+        with open(store.journal_path, "wb") as f:
+            f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, VERSION, store._generation - 1))
+            f.write(JOURNAL_RECORD.pack(MESSAGE, -1, NOW))
+
+        restored, store = self.open_store()
+        await store.restore()
+        self.assertEqual(snapshot_of(restored), snapshot_of(tracker))
+
+
+if __name__ == "__main__":
+    unittest.main()
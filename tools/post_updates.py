@@ -0,0 +1,40 @@
+"""POSTs recorded Telegram updates (one JSON object per line) to a running webhook.
+
+    python tools/post_updates.py updates.jsonl --url http://127.0.0.1:8443/telegram --secret "$WEBHOOK_SECRET"
+
+Prints the HTTP status and response time of every update. The bot answers
+as soon as an update is queued, so times should stay in the low milliseconds
+even when handlers are slow.
+"""
+import argparse
+import json
+import sys
+import time
+
+import httpx
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("updates", help="JSONL file with one update per line")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", help="value of WEBHOOK_SECRET")
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    failures = 0
+    with open(args.updates, encoding="utf-8") as f, httpx.Client(timeout=10) as client:
+        for line in f:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            started = time.perf_counter()
+            response = client.post(args.url, json=update, headers=headers)
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"update {update.get('update_id')}: {response.status_code} in {elapsed:.1f} ms")
+            failures += response.status_code != 200
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import io
+import json
+import logging
+import mmap
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from assets import BASE_DIR, load_folder_entries
+
+# Telegram recompresses photos to 1280px anyway, so anything above that is wasted upload
+MAX_SIDE = 1280
+JPEG_QUALITY = 75
+# 16x16 difference hash; distinct cards of the deck share the same frame and are still 17+ bits apart
+HASH_SIZE = 16
+NEAR_DUPLICATE_BITS = 4
+
+CARD_PACK_PATH = os.path.join(BASE_DIR, "mistchypark.pack")
+
+
+def difference_hash(img, size=HASH_SIZE):
+    gray = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = value << 1 | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def make_variant(path, max_side=MAX_SIDE, quality=JPEG_QUALITY):
+    """Returns (jpeg bytes, width, height, difference hash) for one image"""
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        return buffer.getvalue(), img.width, img.height, difference_hash(img)
+
+
+def build_pack(folder, pack_path, base_dir=BASE_DIR):
+    """Encodes every image of a folder into one pack file and returns a per-image report.
+
+    Byte-identical images (same git hash) and near-identical ones (difference
+    hash within NEAR_DUPLICATE_BITS) are stored once; the index maps them to
+    the image that was kept. If re-encoding doesn't make a file smaller the
+    original bytes are packed as they are.
+    """
+    if Image is None:
+        raise RuntimeError("Pillow is required to build image variants")
+
+    entries = load_folder_entries(folder, base_dir=base_dir)
+    variants = {}
+    duplicates = {}
+    hashes = []  # (difference hash, sha) of kept images
+    report = []
+    tmp_path = pack_path + ".tmp"
+    with open(tmp_path, "wb") as pack:
+        for entry in entries:
+            sha = entry["sha"]
+            if sha in variants or sha in duplicates:
+                report.append((entry["name"], entry["size"], 0, "duplicate"))
+                continue
+
+            path = os.path.join(base_dir, folder, entry["name"])
+            data, width, height, dhash = make_variant(path)
+            twin = next((kept for h, kept in hashes if bin(h ^ dhash).count("1") <= NEAR_DUPLICATE_BITS), None)
+            if twin is not None:
+                duplicates[sha] = twin
+                report.append((entry["name"], entry["size"], 0, f"near-duplicate of {variants[twin]['name']}"))
+                continue
+
+            if len(data) >= entry["size"]:
+                with open(path, "rb") as f:
+                    data = f.read()
+                width, height = entry["width"], entry["height"]
+            variants[sha] = {
+                "name": entry["name"],
+                "offset": pack.tell(),
+                "length": len(data),
+                "width": width,
+                "height": height,
+            }
+            pack.write(data)
+            hashes.append((dhash, sha))
+            report.append((entry["name"], entry["size"], len(data), "kept"))
+
+    index = {
+        "source_shas": sorted(entry["sha"] for entry in entries),
+        "variants": variants,
+        "duplicates": duplicates,
+    }
+    os.replace(tmp_path, pack_path)
+    with open(pack_path + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(pack_path + ".json.tmp", pack_path + ".json")
+    return report
+
+
+class VariantPack:
+    """Memory-mapped pack of pre-encoded images, looked up by source git hash"""
+
+    def __init__(self, pack_path):
+        with open(pack_path + ".json", encoding="utf-8") as f:
+            index = json.load(f)
+        self.source_shas = frozenset(index["source_shas"])
+        self.variants = index["variants"]
+        self.duplicates = index["duplicates"]
+        self._file = open(pack_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.variants else b""
+        self._deck_source = None
+        self._deck = ()
+
+    def matches(self, assets):
+        return self.source_shas == {asset.sha for asset in assets}
+
+    def get(self, sha):
+        """Optimized bytes for an image (or the image it duplicates), None if not packed"""
+        variant = self.variants.get(self.duplicates.get(sha, sha))
+        if variant is None:
+            return None
+        return self._map[variant["offset"]:variant["offset"] + variant["length"]]
+
+    def unique(self, assets):
+        """assets without duplicates, cached until a different tuple is passed in"""
+        if assets is not self._deck_source:
+            self._deck = tuple(asset for asset in assets if asset.sha not in self.duplicates)
+            self._deck_source = assets
+        return self._deck
+
+    def close(self):
+        if self.variants:
+            self._map.close()
+        self._file.close()
+
+
+def load_or_build_pack(folder, pack_path, assets, base_dir=BASE_DIR):
+    """Opens the pack for assets, rebuilding it first if it is missing or stale"""
+    try:
+        pack = VariantPack(pack_path)
+        if pack.matches(assets):
+            return pack
+        pack.close()
+    except (OSError, ValueError, KeyError):
+        pass
+    if Image is None:
+        logging.info(f"ℹ️ Pillow is not installed, {folder}/ will be sent without optimized variants")
+        return None
+
+    report = build_pack(folder, pack_path, base_dir=base_dir)
+    before = sum(original for _, original, _, _ in report)
+    after = sum(packed for _, _, packed, _ in report)
+    logging.info(f"✅ Built {folder}/ variants: {before} -> {after} bytes ({len(report)} images)")
+    return VariantPack(pack_path)
+
+
+if __name__ == "__main__":
+    # Build the card pack and print what every image saved
+    report = build_pack("mistchypark", CARD_PACK_PATH)
+    for name, original, packed, note in report:
+        saved = 100 * (original - packed) / original if packed else 100
+        print(f"{name:24} {original:>8} -> {packed:>8} bytes  {saved:5.1f}%  {note}")
+    total_before = sum(original for _, original, _, _ in report)
+    total_after = sum(packed for _, _, packed, _ in report)
+    print(f"✅ {total_before} -> {total_after} bytes ({100 * (total_before - total_after) / total_before:.1f}% saved)")